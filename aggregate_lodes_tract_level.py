@@ -1,77 +1,272 @@
-import glob
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from geocodes import format_geocodes, truncate
+import instrumentation
+from lodes_partitions import level_dir, write_partitions
+from lodes_store import OD_COLUMNS, SEGMENTS, YEAR, od_chunks, od_files, read_xwalk
 
+# fmt: off
+STATES = [
+    "ak", "al", "ar", "az", "ca", "co", "ct", "dc", "de", "fl",
+    "ga", "hi", "ia", "id", "il", "in", "ks", "ky", "la", "ma",
+    "md", "me", "mi", "mn", "mo", "ms", "mt", "nc", "nd", "ne",
+    "nh", "nj", "nm", "nv", "ny", "oh", "ok", "or", "pa", "ri",
+    "sc", "sd", "tn", "tx", "ut", "va", "vt", "wa", "wi", "wv",
+    "wy",
+]
+# fmt: on
 
-def main():
-
-    # fmt: off
-    STATES = [
-        "ak", "al", "ar", "az", "ca", "co", "ct", "dc", "de", "fl",
-        "ga", "hi", "ia", "id", "il", "in", "ks", "ky", "la", "ma",
-        "md", "me", "mn", "mo", "ms", "mt", "nc", "nd", "ne", "nh",
-        "nj", "nm", "nm", "nv", "ny", "oh", "ok", "or", "pa", "ri",
-        "sc", "sd", "tn", "tx", "ut", "va", "vt", "wa", "wi", "wv",
-        "wy",
-    ]
-    # fmt: on
-
-    for state in tqdm(STATES):
-        metadata = pd.read_csv(
-            f"data/raw/LODES7/{state}/{state}_xwalk.csv.gz",
-            sep=",",
-            usecols=[
-                "st",
-                "cty",
-                "trct",
-                "zcta",
-                "stname",
-                "stusps",
-                "ctyname",
-                "trctname",
-            ],
-            compression="gzip",
-            encoding="latin-1",
-            dtype="str",
-        )
+LEVELS = ["block", "tract", "county", "state"]
+DEFAULT_LEVELS = ["tract", "county", "state"]
+
+# The crosswalk columns describing each level: its keys, and its names.
+METADATA = {
+    "tract": (
+        ["st", "cty", "trct"],
+        ["zcta", "stname", "stusps", "ctyname", "trctname"],
+    ),
+    "county": (["st", "cty"], ["stname", "stusps", "ctyname"]),
+    "state": (["st"], ["stname", "stusps"]),
+}
+
+# A rough estimate of the memory needed per OD row while parsing, with the
+# geocodes parsed straight to integers and every job segment summed alongside
+# the total. Used to turn --max-memory into a chunk size.
+BYTES_PER_ROW = 200
+
+
+def output_dir(level, year=YEAR):
+    return str(level_dir(level, year))
+
+
+def state_size(state, year=YEAR):
+    """The total size of a state's OD files, used to schedule large states first."""
+    return sum(os.path.getsize(fname) for fname in od_files(state, year))
+
+
+def sum_flows(dfs):
+    """Concatenate partial flow tables and sum the counts of repeated pairs."""
+    df = pd.concat(dfs, axis=0, ignore_index=True)
+    return df.groupby(["source", "target"]).sum().reset_index()
+
+
+def rollup(df, levels):
+    """Sum block flows up to each of `levels`, each from the next finer one."""
+    sums = {}
+    finer = "block"
+    for level in LEVELS:
+        if level not in levels:
+            continue
+        if level != finer:
+            df = df.assign(
+                source=truncate(df["source"], finer, level),
+                target=truncate(df["target"], finer, level),
+            )
+        df = sums[level] = sum_flows([df])
+        finer = level
+    return sums
+
+
+def write_metadata(state, levels, year=YEAR):
+    metadata = read_xwalk(
+        state,
+        columns=[
+            "st",
+            "cty",
+            "trct",
+            "zcta",
+            "stname",
+            "stusps",
+            "ctyname",
+            "trctname",
+        ],
+    )
 
-        metadata = metadata.groupby(["st", "cty", "trct"]).first().reset_index()
-        metadata.to_csv(
-            f"data/derived/lodes_tract/{state}_metadata.csv.gz",
+    for level in levels:
+        if level == "block":
+            # The crosswalk itself describes the blocks.
+            continue
+        keys, names = METADATA[level]
+        columns = [c for c in metadata.columns if c in keys + names]
+        metadata.loc[:, columns].groupby(keys).first().reset_index().to_csv(
+            f"{output_dir(level, year)}/{state}_metadata.csv.gz",
             index=False,
             compression="gzip",
         )
 
-        files = glob.glob(f"data/raw/LODES7/{state}/od/{state}_od_*_JT00_2016.csv.gz")
-        dfs = []
 
-        for fname in files:
-            df = pd.read_csv(
-                fname,
-                sep=",",
-                usecols=["w_geocode", "h_geocode", "S000"],
+def aggregate_state(state, max_memory=None, levels=DEFAULT_LEVELS, year=YEAR):
+    with instrumentation.stage("write metadata"):
+        write_metadata(state, levels, year)
+
+    if max_memory is None:
+        chunksize = None
+    else:
+        chunksize = max(1, int(max_memory * 2 ** 20) // BYTES_PER_ROW)
+
+    # Each chunk is rolled up to every level as soon as it is read, each level
+    # from the next finer one. A level's partial sums are folded together
+    # whenever they outgrow the chunk budget (or the previous fold), so memory
+    # tracks the number of distinct pairs rather than the number of block rows.
+    partials = {level: [] for level in levels}
+    partial_rows = dict.fromkeys(levels, 0)
+    folded_rows = dict.fromkeys(levels, 0)
+    # The job segments are summed with the total in the same pass, and kept
+    # in the partitions as extra edge columns.
+    for _, arrays in od_chunks(state, chunksize, OD_COLUMNS, year):
+        with instrumentation.stage("roll up", rows=len(arrays["S000"])):
+            df = pd.DataFrame(
+                {
+                    "target": arrays["w_geocode"],
+                    "source": arrays["h_geocode"],
+                    "weight": arrays["S000"].astype(np.int64),
+                    **{s: arrays[s].astype(np.int64) for s in SEGMENTS},
+                }
+            )
+
+            for level, sums in rollup(df, levels).items():
+                partials[level].append(sums)
+                partial_rows[level] += len(sums)
+
+                unfolded_rows = partial_rows[level] - folded_rows[level]
+                if chunksize is not None and unfolded_rows > max(
+                    chunksize, folded_rows[level]
+                ):
+                    partials[level] = [sum_flows(partials[level])]
+                    partial_rows[level] = len(partials[level][0])
+                    folded_rows[level] = partial_rows[level]
+
+    for level in levels:
+        with instrumentation.stage(f"write {level} flows") as record:
+            df = sum_flows(partials.pop(level))
+            write_partitions(df, level, state, year)
+            df = df.loc[:, ["source", "target", "weight"]]
+            df["source"] = format_geocodes(df["source"], level)
+            df["target"] = format_geocodes(df["target"], level)
+            df.to_csv(
+                f"{output_dir(level, year)}/{state}_flow.csv.gz",
+                index=False,
                 compression="gzip",
-                encoding="latin-1",
-                dtype={"w_geocode": "str", "h_geocode": "str", "S000": "int"},
-            ).rename(
-                columns={"w_geocode": "target", "h_geocode": "source", "S000": "weight"}
             )
+            record["rows"] = len(df)
 
-            df["target"] = df["target"].str[:11]
-            df["source"] = df["source"].str[:11]
+    return state
 
-            dfs.append(df)
 
-        df = pd.concat(dfs, axis=0, ignore_index=True)
-        del dfs
-        df = df.groupby(["source", "target"]).agg({"weight": "sum"}).reset_index()
+def aggregate_worker(state, max_memory, levels, profile, year=YEAR):
+    """aggregate_state in a worker, returning its stage records with the state."""
+    if profile and not instrumentation.ENABLED:
+        instrumentation.enable()
+    # Forked workers start with a copy of the parent's records.
+    instrumentation.take()
+    return aggregate_state(state, max_memory, levels, year), instrumentation.take()
 
-        df.to_csv(
-            f"data/derived/lodes_tract/{state}_flow.csv.gz",
-            index=False,
-            compression="gzip",
-        )
+
+def main(workers=1, max_memory=None, states=None, levels=DEFAULT_LEVELS, year=YEAR):
+    if states is None:
+        states = STATES
+    else:
+        states = [x.strip().lower() for x in states.split(",")]
+    levels = [level for level in LEVELS if level in levels]
+    for level in levels:
+        os.makedirs(output_dir(level, year), exist_ok=True)
+
+    # Start with the biggest states (ca, tx, ny, ...) so that a straggler
+    # doesn't end up running alone at the end of the pool.
+    states = sorted(
+        sorted(set(states)), key=lambda state: state_size(state, year), reverse=True
+    )
+
+    if workers == 1:
+        for state in tqdm(states):
+            aggregate_state(state, max_memory, levels, year)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                aggregate_worker,
+                state,
+                max_memory,
+                levels,
+                instrumentation.ENABLED,
+                year,
+            )
+            for state in states
+        ]
+        with tqdm(total=len(futures)) as progress:
+            for future in as_completed(futures):
+                state, records = future.result()
+                instrumentation.RECORDS.extend(records)
+                progress.set_postfix_str(state)
+                progress.update()
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Aggregate block-level LODES flows to tract, county and "
+        "state level."
+    )
+    parser.add_argument(
+        "-s",
+        "--states",
+        action="store",
+        help="A comma-separated list of two-letter state USPS codes to "
+        "aggregate. If this argument is absent, aggregate all 50 states + DC.",
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        help="The number of states to process in parallel. If this argument "
+        "is absent, process one state at a time.",
+        default=1,
+    )
+    parser.add_argument(
+        "-M",
+        "--max-memory",
+        action="store",
+        type=float,
+        help="An approximate memory budget in MB for each state's OD rows. If "
+        "this argument is present, OD files are read in chunks and folded "
+        "into the sums of each level as they are read; otherwise each file is "
+        "read whole. With --workers, the budget applies to each worker.",
+        default=None,
+    )
+    parser.add_argument(
+        "-l",
+        "--levels",
+        action="store",
+        help=f"A comma-separated list of levels to aggregate to "
+        f"({', '.join(LEVELS)}), written to data/derived/lodes_<level>. All "
+        "levels are summed in the same pass over the OD files. If this "
+        f"argument is absent, use {','.join(DEFAULT_LEVELS)}.",
+        default=",".join(DEFAULT_LEVELS),
+    )
+    parser.add_argument(
+        "-y",
+        "--year",
+        action="store",
+        type=int,
+        help=f"The year of the LODES flows to aggregate. Years other than {YEAR} "
+        "are written to a <year> subfolder of each level's folder, for "
+        "lodes_panel.py.",
+        default=YEAR,
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.start(args)
+    main(
+        args.workers,
+        args.max_memory,
+        args.states,
+        [x.strip() for x in args.levels.split(",")],
+        args.year,
+    )
+    instrumentation.report("data/derived/aggregate_lodes.profile.json")
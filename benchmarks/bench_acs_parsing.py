@@ -0,0 +1,81 @@
+import sys
+import time
+from pathlib import Path
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from acs_flows import parse_counts  # noqa: E402
+from construct_town_network import SCHEMA, construct_fips  # noqa: E402
+
+# Compares the row-wise FIPS construction and count parsing that the county
+# and town builders used to do against the whole-column versions, on the full
+# national table3 workbook. Run from the repository root:
+#
+#   python benchmarks/bench_acs_parsing.py
+
+
+def parseint(s):
+    try:
+        return int(s)
+    except ValueError:
+        s = s.replace(",", "")
+        return int(s)
+
+
+def rowwise(df):
+    df = df.copy()
+    df["margin"] = df["margin"].apply(parseint)
+    for side in ["source", "target"]:
+        df[f"{side}_fips"] = df.apply(
+            lambda row: construct_fips(
+                row[f"{side}_state_fips_code"],
+                row[f"{side}_county_fips_code"],
+                row[f"{side}_mcd_fips_code"],
+            ),
+            axis=1,
+        )
+        df = df.loc[df[f"{side}_fips"].apply(lambda s: len(s) == 10), :]
+    return df
+
+
+def vectorized(df):
+    df = df.copy()
+    df["margin"] = parse_counts(df["margin"]).astype(int)
+    for side in ["source", "target"]:
+        df[f"{side}_fips"] = construct_fips(
+            df[f"{side}_state_fips_code"],
+            df[f"{side}_county_fips_code"],
+            df[f"{side}_mcd_fips_code"],
+        )
+        df = df.loc[df[f"{side}_fips"].str.len() == 10, :]
+    return df
+
+
+def main():
+    df = pd.read_excel(
+        "data/raw/table3.xlsx",
+        skiprows=7,
+        header=None,
+        names=SCHEMA.keys(),
+        dtype=SCHEMA,
+    )
+    df = df.loc[pd.notnull(df["weight"]) & pd.notnull(df["margin"]), :]
+    for side in ["source", "target"]:
+        df[f"{side}_mcd_fips_code"] = df[f"{side}_mcd_fips_code"].fillna("00000")
+    print(f"{len(df)} rows")
+
+    timings = {}
+    results = {}
+    for name, func in [("row-wise", rowwise), ("vectorized", vectorized)]:
+        start = time.perf_counter()
+        results[name] = func(df)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:>12}: {timings[name]:8.3f}s")
+
+    pd.testing.assert_frame_equal(results["row-wise"], results["vectorized"])
+    print(f"{'speedup':>12}: {timings['row-wise'] / timings['vectorized']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import aggregate_lodes_tract_level  # noqa: E402
+import construct_block_network  # noqa: E402
+import construct_county_network  # noqa: E402
+import construct_lodes_network  # noqa: E402
+import construct_town_network  # noqa: E402
+import construct_tract_network  # noqa: E402
+import geography_store  # noqa: E402
+import lodes_store  # noqa: E402
+from synthetic_data import generate  # noqa: E402
+
+# Runs every stage of the pipeline on synthetic data (see synthetic_data.py)
+# and records each stage's wall time, peak memory and a digest of its result.
+# Each stage runs in a fresh process forked from this one, so its peak RSS is
+# its own. The results are compared against a stored baseline of the same
+# size: a changed digest means the stage's output changed, and a stage that
+# got slower or bigger by more than the tolerance is a regression. Run from
+# the repository root:
+#
+#   python benchmarks/bench_pipeline.py -n 2 --save    # record a baseline
+#   python benchmarks/bench_pipeline.py -n 2           # compare against it
+#
+# baseline.json holds a reference baseline for -n 1. The digests hold on any
+# machine, but the timings depend on it, so record the baseline again on the
+# machine that runs the comparison before relying on them.
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+# Differences smaller than these are noise, whatever the tolerance.
+SLACK = {"seconds": 0.5, "peak_mb": 10}
+
+
+def graph_digest(G):
+    """A digest of a network's nodes, edges and attributes, ignoring order."""
+    nodes = sorted((str(n), sorted(d.items())) for n, d in G.nodes(data=True))
+    edges = sorted(
+        (str(u), str(v), sorted(d.items())) for u, v, d in G.edges(data=True)
+    )
+    return hashlib.sha256(repr((nodes, edges)).encode()).hexdigest()
+
+
+def files_digest(pattern):
+    """A digest of the lines of every gzipped file matching `pattern`, sorted."""
+    digest = hashlib.sha256()
+    for fname in sorted(glob.glob(pattern)):
+        with gzip.open(fname, "rt") as f:
+            lines = f.readlines()
+        digest.update(Path(fname).name.encode())
+        digest.update("".join(lines[:1] + sorted(lines[1:])).encode())
+    return digest.hexdigest()
+
+
+def network(module, *args):
+    def run():
+        return graph_digest(module.construct_network(*args, 1, "benchmark"))
+
+    return run
+
+
+def aggregate():
+    aggregate_lodes_tract_level.main(levels=["tract", "county", "state"])
+    return files_digest("data/derived/lodes_*/*.csv.gz")
+
+
+def geography():
+    for group in geography_store.GROUPS:
+        geography_store.refresh(group)
+
+
+STAGES = {
+    "store": lambda: lodes_store.main(),
+    "aggregate": aggregate,
+    "geography": geography,
+    "county": network(construct_county_network, None),
+    "town": network(construct_town_network, None),
+    "tract": network(construct_tract_network, None),
+    "block": network(construct_block_network, None),
+    "lodes_county": network(construct_lodes_network, "county", None),
+    "lodes_state": network(construct_lodes_network, "state", None),
+}
+
+
+def run_stage(name, conn):
+    start = time.perf_counter()
+    digest = STAGES[name]()
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in KB on Linux.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    conn.send({"seconds": seconds, "peak_mb": peak, "digest": digest})
+
+
+def run(directory, size, stages):
+    """Run `stages` in order on synthetic data of `size` in `directory`."""
+    if not (Path(directory) / "data" / "raw").is_dir():
+        generate(directory, size)
+    if stages[0] == next(iter(STAGES)):
+        # Start from the raw data only, so every stage does all of its work.
+        for derived in ["data/derived", "data/cache"]:
+            shutil.rmtree(Path(directory) / derived, ignore_errors=True)
+
+    cwd = os.getcwd()
+    os.chdir(directory)
+    context = multiprocessing.get_context("fork")
+    results = {}
+    try:
+        for name in stages:
+            receive, send = context.Pipe(duplex=False)
+            process = context.Process(target=run_stage, args=(name, send))
+            process.start()
+            send.close()
+            try:
+                result = receive.recv()
+            except EOFError:
+                raise RuntimeError(f"The {name} stage failed.") from None
+            finally:
+                process.join()
+            results[name] = result
+            print(
+                f"{name:>12}: {result['seconds']:8.2f}s {result['peak_mb']:8.1f} MB",
+                flush=True,
+            )
+    finally:
+        os.chdir(cwd)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of `results` against `baseline`, as messages."""
+    problems = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if result["digest"] != base["digest"]:
+            problems.append(f"{name}: output changed")
+        for key, unit in [("seconds", "s"), ("peak_mb", " MB")]:
+            limit = max(base[key] * (1 + tolerance), base[key] + SLACK[key])
+            if result[key] > limit:
+                problems.append(
+                    f"{name}: {key} {result[key]:.2f}{unit} vs "
+                    f"{base[key]:.2f}{unit} in the baseline"
+                )
+    return problems
+
+
+def main(size=1, directory=None, stages=None, save=False, tolerance=0.5):
+    stages = list(STAGES) if stages is None else stages
+    if directory is None:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = run(tmp, size, stages)
+    else:
+        results = run(directory, size, stages)
+
+    baselines = {}
+    if BASELINE.is_file():
+        with open(BASELINE) as f:
+            baselines = json.load(f)
+    if save:
+        baselines.setdefault(str(size), {}).update(results)
+        with open(BASELINE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+        print(f"saved the baseline for size {size}")
+        return 0
+
+    if str(size) not in baselines:
+        print(f"no baseline for size {size}; record one with --save")
+        return 0
+    problems = compare(results, baselines[str(size)], tolerance)
+    for problem in problems:
+        print(problem)
+    if not problems:
+        print("no regressions")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the pipeline on synthetic data."
+    )
+    parser.add_argument(
+        "-n",
+        "--size",
+        action="store",
+        type=int,
+        help="The size of the synthetic data (see synthetic_data.py).",
+        default=1,
+    )
+    parser.add_argument(
+        "-d",
+        "--directory",
+        action="store",
+        help="A directory to keep the synthetic data in, generated if missing. "
+        "If this argument is absent, use a temporary directory.",
+        default=None,
+    )
+    parser.add_argument(
+        "-k",
+        "--stages",
+        action="store",
+        help=f"A comma-separated list of stages to run ({', '.join(STAGES)}). "
+        "Later stages need the outputs of earlier ones. If this argument is "
+        "absent, run every stage.",
+        default=None,
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Record the results as the baseline for this size.",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        action="store",
+        type=float,
+        help="How much slower or bigger than the baseline a stage may get, as "
+        "a fraction of the baseline.",
+        default=0.5,
+    )
+    args = parser.parse_args()
+    sys.exit(
+        main(
+            args.size,
+            args.directory,
+            None if args.stages is None else args.stages.split(","),
+            args.save,
+            args.tolerance,
+        )
+    )
@@ -0,0 +1,269 @@
+import argparse
+import json
+import os
+import sys
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from collect_population_data import (  # noqa: E402
+    CENSUS_VARS,
+    TYPES,
+    process_response,
+    raw_path,
+    write_table,
+)
+from state_fips_mapping import FIPS_TO_STATE  # noqa: E402
+
+# Writes synthetic inputs for the whole pipeline, in the layouts the download
+# scripts leave behind, so the builds can be run and timed without the Census
+# data: LODES OD and crosswalk files for every state, the ACS commuting-flow
+# workbooks, the gazetteer files and the population tables (with their raw API
+# responses). Every state gets (2 + size) counties of (2 + size) tracts of
+# (4 * size) blocks, and the number of flows grows with the size too. The
+# output only depends on the size and the seed.
+#
+#   python benchmarks/synthetic_data.py /tmp/synthetic -n 4
+
+SEGMENTS = {
+    "SA": ["SA01", "SA02", "SA03"],
+    "SE": ["SE01", "SE02", "SE03"],
+    "SI": ["SI01", "SI02", "SI03"],
+}
+MCDS_PER_COUNTY = 2
+# The share of OD rows whose home is in the county of the workplace.
+LOCAL_SHARE = 0.7
+
+
+def geographies(size):
+    """Every block of the synthetic country, in order, with its parents."""
+    rows = []
+    for st, state in FIPS_TO_STATE.items():
+        for c in range(2 + size):
+            county = f"{st}{2 * c + 1:03d}"
+            for t in range(2 + size):
+                tract = f"{county}{(t + 1) * 100:06d}"
+                for b in range(4 * size):
+                    rows.append((state, st, county, tract, f"{tract}{1000 + b}"))
+    return pd.DataFrame(rows, columns=["state", "st", "cty", "trct", "tabblk2010"])
+
+
+def write_xwalk(blocks, state, rng):
+    n = len(blocks)
+    xwalk = pd.DataFrame(
+        {
+            "tabblk2010": blocks["tabblk2010"],
+            "st": blocks["st"],
+            "stusps": state.upper(),
+            "stname": f"State {state.upper()}",
+            "cty": blocks["cty"],
+            "ctyname": "County " + blocks["cty"].str[2:] + f", {state.upper()}",
+            "trct": blocks["trct"],
+            "trctname": (
+                (blocks["trct"].str[5:9].astype(int)).astype(str)
+                + " ("
+                + blocks["cty"].str[2:]
+                + f", {state.upper()})"
+            ),
+            "zcta": "0" + (10000 + blocks["cty"].str[2:].astype(int)).astype(str),
+            "blklatdd": [f"{x:.7f}" for x in 30 + 15 * rng.random(n)],
+            "blklondd": [f"{x:.7f}" for x in -120 + 50 * rng.random(n)],
+        }
+    )
+    xwalk.to_csv(
+        f"data/raw/LODES7/{state}/{state}_xwalk.csv.gz",
+        index=False,
+        compression="gzip",
+    )
+
+
+def write_od(blocks, everywhere, state, part, rows, rng):
+    """One OD file: workplaces in the state; homes nearby, or in other states for aux.
+
+    As in LODES, the main file holds the homes in the state and the aux file
+    only those outside it, so no pair of blocks is in both.
+    """
+    codes = blocks["tabblk2010"].to_numpy()
+    work = rng.integers(0, len(codes), rows)
+    if part == "main":
+        # Blocks are grouped by county, so a home in the workplace's county is
+        # an offset into the same run of blocks.
+        county = blocks["cty"].to_numpy()
+        start = np.searchsorted(county, county[work], side="left")
+        end = np.searchsorted(county, county[work], side="right")
+        local = start + (rng.random(rows) * (end - start)).astype(int)
+        home = np.where(
+            rng.random(rows) < LOCAL_SHARE, local, rng.integers(0, len(codes), rows)
+        )
+        homes = codes[home]
+    else:
+        homes = rng.choice(everywhere[~np.isin(everywhere, codes)], rows)
+
+    od = pd.DataFrame({"w_geocode": codes[work], "h_geocode": homes})
+    od = od.drop_duplicates().sort_values(["w_geocode", "h_geocode"])
+    jobs = rng.geometric(0.3, len(od))
+    od["S000"] = jobs
+    for segments in SEGMENTS.values():
+        split = rng.multinomial(jobs, [1 / len(segments)] * len(segments))
+        for i, segment in enumerate(segments):
+            od[segment] = split[:, i]
+    od["createdate"] = "20190826"
+    od.to_csv(
+        f"data/raw/LODES7/{state}/od/{state}_od_{part}_JT00_2016.csv.gz",
+        index=False,
+        compression="gzip",
+    )
+
+
+def write_gazetteer(kind, geoids, rng):
+    n = len(geoids)
+    gazetteer = pd.DataFrame(
+        {
+            "USPS": [FIPS_TO_STATE[g[:2]].upper() for g in geoids],
+            "GEOID": geoids,
+            "NAME": [f"Place {g}" for g in geoids],
+            "ALAND": rng.integers(10 ** 6, 10 ** 9, n),
+            "AWATER": rng.integers(0, 10 ** 7, n),
+            "INTPTLAT": (30 + 15 * rng.random(n)).round(6),
+            # The last header of the real files is padded with whitespace.
+            "INTPTLONG" + " " * 110: (-120 + 50 * rng.random(n)).round(6),
+        }
+    )
+    gazetteer.to_csv(f"data/raw/2019_Gaz_{kind}_national.txt", sep="\t", index=False)
+
+
+def write_population(level, geoids, rng):
+    """Raw API responses and the tables collect_population_data.py makes of them."""
+    DIR, LEVEL, FIPS_COLUMNS = next(t for t in TYPES if Path(t[0]).name == level)
+    widths = {"state": 2, "county": 3, "county subdivision": 5, "tract": 6}
+    Path(DIR).mkdir(parents=True, exist_ok=True)
+    for st, state in FIPS_TO_STATE.items():
+        content = [["NAME"] + CENSUS_VARS + FIPS_COLUMNS]
+        for geoid in (g for g in geoids if g[:2] == st):
+            counts = rng.integers(0, 500, len(CENSUS_VARS))
+            counts[0] = counts[1:].sum()
+            fips, rest = [], geoid
+            for column in FIPS_COLUMNS:
+                fips.append(rest[: widths[column]])
+                rest = rest[widths[column] :]
+            content.append([f"Place {geoid}"] + [str(x) for x in counts] + fips)
+
+        raw = raw_path(DIR, state)
+        Path(raw).parent.mkdir(parents=True, exist_ok=True)
+        with open(raw, "w") as f:
+            json.dump(content, f)
+        write_table(process_response(content, FIPS_COLUMNS), DIR, state)
+
+
+def flow_table(geoids, rows, rng, town):
+    """An ACS commuting-flow workbook: 7 title rows, then one row per flow."""
+    pairs = rng.integers(0, len(geoids), (rows, 2))
+    # Most commuters stay in their own state.
+    by_state = pd.Series(range(len(geoids))).groupby([g[:2] for g in geoids])
+    first = by_state.min().reindex([g[:2] for g in geoids]).to_numpy()
+    count = by_state.size().reindex([g[:2] for g in geoids]).to_numpy()
+    local = rng.random(rows) < 0.8
+    pairs[local, 1] = first[pairs[local, 0]] + (
+        rng.random(local.sum()) * count[pairs[local, 0]]
+    ).astype(int)
+    pairs = np.unique(pairs, axis=0)
+
+    def side(geoid, target):
+        state, county, mcd = geoid[:2], geoid[2:5], geoid[5:] or None
+        if town and mcd == "00000":
+            mcd = None
+        codes = ["0" + state if target else state, county]
+        names = [f"State {state}", f"County {county}"]
+        if town:
+            codes.append(mcd)
+            names.append(None if mcd is None else f"Town {mcd}")
+        return codes + names
+
+    table = []
+    for s, t in pairs:
+        weight = int(rng.integers(1, 5000))
+        margin = int(rng.integers(1, 2 * weight + 10))
+        table.append(
+            side(geoids[s], False) + side(geoids[t], True) + [weight, f"{margin:,}"]
+        )
+    # A flow to a foreign destination, which the builders drop.
+    foreign = ["300", "000"] + ([None] if town else []) + ["Canada", None]
+    foreign += [None] if town else []
+    table.append(side(geoids[0], False) + foreign + [15, "12"])
+    df = pd.DataFrame(table)
+
+    title = pd.DataFrame([["Table"] + [None] * (df.shape[1] - 1)] * 7)
+    footnote = pd.DataFrame([["Footnote"] + [None] * (df.shape[1] - 1)])
+    return pd.concat([title, df, footnote], ignore_index=True)
+
+
+def generate(root, size=1, seed=0):
+    rng = np.random.default_rng(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        Path("data/raw").mkdir(parents=True, exist_ok=True)
+        blocks = geographies(size)
+        everywhere = blocks["tabblk2010"].to_numpy()
+        for state, state_blocks in blocks.groupby("state", sort=False):
+            state_blocks = state_blocks.reset_index(drop=True)
+            Path(f"data/raw/LODES7/{state}/od").mkdir(parents=True, exist_ok=True)
+            write_xwalk(state_blocks, state, rng)
+            write_od(state_blocks, everywhere, state, "main", 400 * size, rng)
+            write_od(state_blocks, everywhere, state, "aux", 80 * size, rng)
+
+        counties = sorted(blocks["cty"].unique())
+        tracts = sorted(blocks["trct"].unique())
+        towns = [
+            f"{county}{100 * (m + 1):05d}"
+            for county in counties
+            for m in range(MCDS_PER_COUNTY)
+        ]
+        write_gazetteer("counties", counties, rng)
+        write_gazetteer("tracts", tracts, rng)
+        write_gazetteer("cousubs", towns, rng)
+
+        write_population("county", counties, rng)
+        write_population("town", towns, rng)
+        write_population("tract", tracts, rng)
+
+        # Some counties only report county-level flows in table3.
+        town_nodes = towns + [f"{county}00000" for county in counties[::5]]
+        for name, geoids, town in [
+            ("table1", counties, False),
+            ("table3", sorted(town_nodes), True),
+        ]:
+            flow_table(geoids, 20 * size * len(geoids), rng, town).to_excel(
+                f"data/raw/{name}.xlsx", header=False, index=False
+            )
+    finally:
+        os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write synthetic inputs for the whole pipeline."
+    )
+    parser.add_argument("directory", help="The directory to write data/raw to.")
+    parser.add_argument(
+        "-n",
+        "--size",
+        action="store",
+        type=int,
+        help="The scale of the data. Larger sizes have more blocks, tracts "
+        "and counties, and more flows between them.",
+        default=1,
+    )
+    parser.add_argument(
+        "--seed",
+        action="store",
+        type=int,
+        help="The seed of the random number generator.",
+        default=0,
+    )
+    args = parser.parse_args()
+    generate(args.directory, args.size, args.seed)
@@ -0,0 +1,456 @@
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import subprocess
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from state_fips_mapping import STATE_TO_FIPS
+
+# An incremental build of the whole pipeline, from raw downloads through the
+# derived LODES tables to the networks. Every stage is a target with its own
+# output files, so one missing or stale state is rebuilt on its own. Raw
+# downloads are only fetched when their outputs are missing. Derived targets
+# are also rebuilt when the content of any input file, including the scripts
+# that produce them, or their command changes. Hashes are cached by file size
+# and mtime in data/.build_state.json, so unchanged files are hashed only once.
+#
+#   python build.py                      # build everything that is stale
+#   python build.py -n                   # show what would be rebuilt
+#   python build.py -j 8 'rollup:*'      # aggregate every state, 8 at a time
+
+STATE_FILE = "data/.build_state.json"
+STATES = sorted(STATE_TO_FIPS)
+GAZETTEER_URL = (
+    "https://www2.census.gov/geo/docs/maps-data/data/gazetteer/2019_Gazetteer"
+)
+ACS_URL = (
+    "https://www2.census.gov/programs-surveys/demo/tables/metro-micro/2015/"
+    "commuting-flows-2015"
+)
+
+# Modules imported by the network scripts.
+SHARED_MODULES = [
+    "acs_flows.py",
+    "columnar.py",
+    "csr_network.py",
+    "geocodes.py",
+    "geography_store.py",
+    "graphml_writer.py",
+    "instrumentation.py",
+    "lodes_partitions.py",
+    "lodes_store.py",
+    "network_bundle.py",
+    "result_cache.py",
+    "state_fips_mapping.py",
+    "threshold_sweep.py",
+]
+
+# The levels aggregate_lodes_tract_level.py rolls the LODES flows up to.
+ROLLUP_LEVELS = ["tract", "county", "state"]
+
+# The networks to build: (level, states, output, minimum weight, extra args).
+# The lodes_* levels are built by construct_lodes_network.py.
+NETWORKS = [
+    ("county", "ma", "massachusetts", 1, []),
+    ("town", "ma", "massachusetts", 1, []),
+    ("tract", "ma", "massachusetts", 1, []),
+    ("block", "ma", "massachusetts", 1, ["-b", "csr"]),
+    ("county", None, "national", 1, []),
+    ("town", None, "national", 1, []),
+    ("tract", None, "national", 1, []),
+    ("lodes_county", None, "national", 1, []),
+    ("lodes_state", None, "national", 1, []),
+]
+
+
+class Target:
+    def __init__(self, name, command, outputs, inputs=(), download=False):
+        self.name = name
+        self.command = command
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.download = download
+        self.deps = []
+
+
+def od_files(state):
+    return [
+        f"data/raw/LODES7/{state}/od/{state}_od_{part}_JT00_2016.csv.gz"
+        for part in ["main", "aux"]
+    ]
+
+
+def xwalk_file(state):
+    return f"data/raw/LODES7/{state}/{state}_xwalk.csv.gz"
+
+
+def store_file(state):
+    return f"data/derived/lodes_store/{state}/inputs.json"
+
+
+def population_file(level, state):
+    return f"data/raw/population_data/{level}/{state}.tsv"
+
+
+def rollup_files(state, level="tract"):
+    return [
+        f"data/derived/lodes_{level}/{state}_flow.csv.gz",
+        f"data/derived/lodes_{level}/{state}_metadata.csv.gz",
+        partition_file(state, level),
+    ]
+
+
+def partition_file(state, level="tract"):
+    return f"data/derived/lodes_{level}/partitions/{STATE_TO_FIPS[state]}.json"
+
+
+def network_script(level):
+    if level.startswith("lodes_"):
+        return "construct_lodes_network.py"
+    return f"construct_{level}_network.py"
+
+
+def geography_file(group):
+    return f"data/derived/geography/{group}.json"
+
+
+def geography_inputs(group):
+    if group == "county":
+        inputs = ["data/raw/2019_Gaz_counties_national.txt"]
+    elif group == "town":
+        inputs = [
+            "data/raw/2019_Gaz_cousubs_national.txt",
+            "data/raw/2019_Gaz_counties_national.txt",
+        ]
+    elif group == "tract":
+        inputs = ["data/raw/2019_Gaz_tracts_national.txt"]
+    else:
+        return [xwalk_file(state) for state in STATES]
+    return inputs + [population_file(group, state) for state in STATES]
+
+
+def network_inputs(level, states):
+    if level == "county":
+        inputs = ["data/raw/table1.xlsx", geography_file("county")]
+    elif level == "town":
+        inputs = ["data/raw/table3.xlsx", geography_file("town")]
+    elif level == "tract":
+        inputs = [geography_file("tract"), geography_file("crosswalk")]
+        inputs += [partition_file(state) for state in states]
+    elif level.startswith("lodes_"):
+        inputs = [geography_file("county"), geography_file("crosswalk")]
+        inputs += [partition_file(state, level[6:]) for state in states]
+    else:
+        inputs = [geography_file("crosswalk")]
+        inputs += [store_file(state) for state in states]
+    return inputs + [network_script(level)] + SHARED_MODULES
+
+
+def targets():
+    """Return every target in the pipeline, keyed by name."""
+    result = []
+    for kind in ["counties", "cousubs", "tracts"]:
+        fname = f"2019_Gaz_{kind}_national"
+        result.append(
+            Target(
+                f"gazetteer:{kind}",
+                f"wget -P data/raw/ {GAZETTEER_URL}/{fname}.zip && "
+                f"unzip -o data/raw/{fname}.zip -d data/raw",
+                [f"data/raw/{fname}.txt"],
+                download=True,
+            )
+        )
+    for table in ["table1", "table3"]:
+        result.append(
+            Target(
+                f"acs:{table}",
+                f"wget -P data/raw/ {ACS_URL}/{table}.xlsx",
+                [f"data/raw/{table}.xlsx"],
+                download=True,
+            )
+        )
+
+    for state in STATES:
+        result.append(
+            Target(
+                f"lodes:{state}",
+                f"bash collect_lodes_data.sh {state}",
+                od_files(state) + [xwalk_file(state)],
+                download=True,
+            )
+        )
+        for level in ["county", "town", "tract"]:
+            result.append(
+                Target(
+                    f"population:{level}:{state}",
+                    f"python collect_population_data.py -s {state} -l {level}",
+                    [population_file(level, state)],
+                    download=True,
+                )
+            )
+        result.append(
+            Target(
+                f"store:{state}",
+                f"python lodes_store.py -s {state}",
+                [store_file(state)],
+                od_files(state)
+                + [
+                    xwalk_file(state),
+                    "lodes_store.py",
+                    "columnar.py",
+                    "instrumentation.py",
+                ],
+            )
+        )
+        result.append(
+            Target(
+                f"rollup:{state}",
+                f"python aggregate_lodes_tract_level.py -s {state} "
+                f"-l {','.join(ROLLUP_LEVELS)}",
+                [f for level in ROLLUP_LEVELS for f in rollup_files(state, level)],
+                [
+                    store_file(state),
+                    "aggregate_lodes_tract_level.py",
+                    "geocodes.py",
+                    "lodes_partitions.py",
+                    "lodes_store.py",
+                    "columnar.py",
+                    "instrumentation.py",
+                ],
+            )
+        )
+
+    for group in ["county", "town", "tract", "crosswalk"]:
+        result.append(
+            Target(
+                f"geography:{group}",
+                f"python geography_store.py -g {group}",
+                [geography_file(group)],
+                geography_inputs(group)
+                + ["geography_store.py", "columnar.py", "instrumentation.py"],
+            )
+        )
+
+    for level, states, output, minimum_weight, extra in NETWORKS:
+        command = ["python", network_script(level)]
+        if level.startswith("lodes_"):
+            command += ["-l", level[6:]]
+        if states is not None:
+            command += ["-s", states]
+        command += ["-o", output, "-m", str(minimum_weight)] + extra
+        result.append(
+            Target(
+                f"network:{level}:{output}",
+                " ".join(command),
+                [f"data/derived/{output}/{level}_commuter_flows.graphml"],
+                network_inputs(
+                    level, STATES if states is None else states.split(",")
+                ),
+            )
+        )
+
+    by_output = {output: t for t in result for output in t.outputs}
+    for t in result:
+        t.deps = sorted({by_output[i].name for i in t.inputs if i in by_output})
+    return {t.name: t for t in result}
+
+
+def select(all_targets, patterns):
+    """The targets matching any of `patterns`, plus everything they depend on."""
+    selected = set()
+    stack = [n for n in all_targets if any(fnmatch.fnmatch(n, p) for p in patterns)]
+    while stack:
+        name = stack.pop()
+        if name not in selected:
+            selected.add(name)
+            stack.extend(all_targets[name].deps)
+    return [n for n in all_targets if n in selected]
+
+
+class BuildState:
+    """Recorded input hashes of built targets, plus a hash cache for files."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = Path(path)
+        self.lock = threading.Lock()
+        if self.path.is_file():
+            with open(self.path) as f:
+                state = json.load(f)
+        else:
+            state = {}
+        self.files = state.get("files", {})
+        self.targets = state.get("targets", {})
+
+    def digest(self, fname):
+        stat = os.stat(fname)
+        with self.lock:
+            cached = self.files.get(fname)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(fname, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(block)
+        with self.lock:
+            self.files[fname] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def signature(self, target):
+        return {
+            "command": target.command,
+            "inputs": {fname: self.digest(fname) for fname in target.inputs},
+        }
+
+    def record(self, target):
+        signature = self.signature(target)
+        with self.lock:
+            self.targets[target.name] = signature
+            self.save()
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump({"files": self.files, "targets": self.targets}, f)
+        tmp.replace(self.path)
+
+
+def stale_reason(target, state, rebuilt=()):
+    """Why `target` needs rebuilding, or None if it is up to date.
+
+    `rebuilt` names the targets that will be (or were) rebuilt in this run,
+    which is how a dry run accounts for inputs that don't exist yet.
+    """
+    for output in target.outputs:
+        if not os.path.exists(output):
+            return f"missing {output}"
+    if target.download:
+        return None
+    for dep in target.deps:
+        if dep in rebuilt:
+            return f"{dep} rebuilt"
+    recorded = state.targets.get(target.name)
+    if recorded is None:
+        return "never built here"
+    if recorded["command"] != target.command:
+        return "command changed"
+    for fname in target.inputs:
+        if recorded["inputs"].get(fname) != state.digest(fname):
+            return f"{fname} changed"
+    return None
+
+
+def dry_run(all_targets, names, state):
+    rebuilt = set()
+    for name in names:
+        reason = stale_reason(all_targets[name], state, rebuilt)
+        if reason is not None:
+            rebuilt.add(name)
+            print(f"{name}: {reason}")
+            print(f"    {all_targets[name].command}")
+    if not rebuilt:
+        print("Everything is up to date.")
+
+
+def build(all_targets, names, state, jobs):
+    """Build the stale targets among `names`, running up to `jobs` at once."""
+
+    def run(target, rebuilt):
+        reason = stale_reason(target, state, rebuilt)
+        if reason is None:
+            return False
+        print(f"[build] {target.name}: {reason}", flush=True)
+        subprocess.run(target.command, shell=True, check=True)
+        missing = [o for o in target.outputs if not os.path.exists(o)]
+        if missing:
+            raise RuntimeError(f"{target.name} did not produce {', '.join(missing)}")
+        state.record(target)
+        return True
+
+    pending = set(names)
+    done = set()
+    rebuilt = set()
+    failed = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                deps = all_targets[name].deps
+                if any(dep in failed for dep in deps):
+                    pending.discard(name)
+                    failed.add(name)
+                    print(f"[skip] {name}: a dependency failed", flush=True)
+                elif all(dep in done or dep not in names for dep in deps):
+                    pending.discard(name)
+                    # A target is rebuilt if any dependency was, even when the
+                    # files it reads come out the same.
+                    future = executor.submit(run, all_targets[name], set(rebuilt))
+                    running[future] = name
+            if not running:
+                if pending:
+                    raise RuntimeError(f"Cannot schedule {', '.join(sorted(pending))}")
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    if future.result():
+                        rebuilt.add(name)
+                    done.add(name)
+                except Exception as e:
+                    failed.add(name)
+                    print(f"[fail] {name}: {e}", flush=True)
+
+    return not failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Incrementally build the commuter networks and their inputs."
+    )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="Glob patterns of targets to build, e.g. 'rollup:*' or "
+        "'network:*:national'. If absent, build every target.",
+        default=["*"],
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="Print the targets that would be rebuilt, and why, without "
+        "building anything.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        action="store",
+        type=int,
+        help="The number of independent targets to build at once.",
+        default=1,
+    )
+    parser.add_argument(
+        "-l",
+        "--list",
+        action="store_true",
+        help="List the selected targets and their dependencies.",
+    )
+    args = parser.parse_args()
+
+    all_targets = targets()
+    names = select(all_targets, args.targets)
+    state = BuildState()
+    if args.list:
+        for name in names:
+            deps = all_targets[name].deps
+            print(f"{name}" + (f" <- {', '.join(deps)}" if deps else ""))
+    elif args.dry_run:
+        dry_run(all_targets, names, state)
+    elif not build(all_targets, names, state, args.jobs):
+        raise SystemExit(1)
@@ -1,7 +1,30 @@
 #!/bin/bash
+# Usage: bash collect_lodes_data.sh [-y year[,year...]] [state ...]
+# With no states, download the OD and crosswalk files for every state. The OD
+# files are those of 2016 unless -y lists other years (e.g. -y 2010,2015,2016).
+years=2016
+while getopts "y:" option
+do
+    case $option in
+        y) years=$OPTARG;;
+        *) exit 1;;
+    esac
+done
+shift $((OPTIND - 1))
+patterns=""
+for year in ${years//,/ }
+do
+    patterns="$patterns*_JT00_$year.csv.gz,"
+done
 mkdir -p "data/raw"
 cd data/raw
-wget -r -np --cut-dirs 2 -nH -N -A '*_JT00_2016.csv.gz,*_xwalk.csv.gz' -R 'us_xwalk.csv.gz' -X "LODES7/*/wac/,LODES7/*/rac/" "https://lehd.ces.census.gov/data/lodes/LODES7/"
+if [ $# -eq 0 ]
+then
+    wget -r -np --cut-dirs 2 -nH -N -A "$patterns*_xwalk.csv.gz" -R 'us_xwalk.csv.gz' -X "LODES7/*/wac/,LODES7/*/rac/" "https://lehd.ces.census.gov/data/lodes/LODES7/"
+else
+    for state in "$@"
+    do
+        wget -r -np --cut-dirs 2 -nH -N -A "$patterns*_xwalk.csv.gz" -X "LODES7/$state/wac/,LODES7/$state/rac/" "https://lehd.ces.census.gov/data/lodes/LODES7/$state/"
+    done
+fi
 cd ../..
-
-
@@ -1,25 +1,39 @@
+import argparse
+import os
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from state_fips_mapping import STATE_TO_FIPS
 from pathlib import Path
 import json
+import numpy as np
 import pandas as pd
+from tqdm import tqdm
+import instrumentation
+
+BASE_URL = "https://api.census.gov/data/2016/acs/acs5"
+WORKERS = 8
+TIMEOUT = 60
+RETRIES = 5
+BACKOFF = 1
 
 # fmt: off
 TYPES = [
     (
         "data/raw/population_data/county/",
         "county",
-        lambda row: row[['state', 'county']].str.cat(),
+        ["state", "county"],
     ),
     (
         "data/raw/population_data/town/",
         "county subdivision",
-        lambda row: row[['state', 'county', 'county subdivision']].str.cat(),
+        ["state", "county", "county subdivision"],
     ),
     (
         "data/raw/population_data/tract/",
         "tract",
-        lambda row: row[['state', 'county', 'tract']].str.cat(),
+        ["state", "county", "tract"],
     ),
 ]
 
@@ -53,35 +67,184 @@ GROUPING = {
     "65+": [18, 19, 20, 21, 22, 23, 41, 42, 43, 44, 45, 46],
 }
 
+# GROUPING as a 0/1 matrix, so that every age band of every row is summed in
+# a single matrix product with the counts.
+GROUPING_MATRIX = np.zeros((len(CENSUS_VARS), len(GROUPING)), dtype=np.int64)
+for column, indices in enumerate(GROUPING.values()):
+    GROUPING_MATRIX[indices, column] = 1
+
+
+def raw_path(DIR, state):
+    return f"{Path(DIR).parent}/raw/{Path(DIR).name}/{state}.json"
+
+
+def process_response(content, FIPS_COLUMNS):
+    """Build a population table from a decoded API response.
+
+    Sums the age bands of GROUPING and adds the FIPS code, the concatenation
+    of FIPS_COLUMNS.
+    """
+    df = pd.DataFrame(content[1:], columns=content[0])
+    counts = df.loc[:, CENSUS_VARS].to_numpy().astype(np.int64)
+    bands = pd.DataFrame(
+        counts @ GROUPING_MATRIX, columns=list(GROUPING), index=df.index
+    )
+    df = pd.concat([df.loc[:, ~df.columns.isin(CENSUS_VARS)], bands], axis=1)
+    fips = df[FIPS_COLUMNS[0]]
+    for column in FIPS_COLUMNS[1:]:
+        fips = fips + df[column]
+    df["FIPS"] = fips
+    return df
+
+
+def write_table(df, DIR, state):
+    # Write to a temporary file first so that an interrupted run never
+    # leaves a partial table behind to be mistaken for a finished one.
+    tmp = f"{DIR}{state}.tsv.tmp"
+    df.to_csv(tmp, sep="\t", index=False)
+    os.replace(tmp, f"{DIR}{state}.tsv")
+
+
+def process(content, FIPS_COLUMNS, DIR, state):
+    with instrumentation.stage("process", rows=len(content) - 1):
+        df = process_response(content, FIPS_COLUMNS)
+    with instrumentation.stage("write table", rows=len(df)):
+        write_table(df, DIR, state)
+
+
+def make_session(workers):
+    """A pooled HTTP session that retries failed requests with backoff."""
+    retry = Retry(
+        total=RETRIES,
+        backoff_factor=BACKOFF,
+        status_forcelist=[429, 500, 502, 503, 504],
+    )
+    adapter = HTTPAdapter(
+        pool_connections=workers, pool_maxsize=workers, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def collect(session, base_url, DIR, LEVEL, FIPS_COLUMNS, state):
+    """Download, keep and process one state's table at one level."""
+    s = (
+        f"{base_url}/?get=NAME,"
+        f"{','.join(CENSUS_VARS)}&for={LEVEL}:*&in=state:{STATE_TO_FIPS[state]}"
+    )
+    with instrumentation.stage("download"):
+        r = session.get(s, timeout=TIMEOUT)
+        r.raise_for_status()
+
+    # Keep the raw response, so the tables can be rebuilt without the API.
+    raw = raw_path(DIR, state)
+    Path(raw).parent.mkdir(parents=True, exist_ok=True)
+    with open(f"{raw}.tmp", "wb") as f:
+        f.write(r.content)
+    os.replace(f"{raw}.tmp", raw)
+
+    process(json.loads(r.content), FIPS_COLUMNS, DIR, state)
+
+
+def reprocess(DIR, LEVEL, FIPS_COLUMNS, state):
+    """Rebuild one state's table from its saved raw response."""
+    with open(raw_path(DIR, state)) as f:
+        content = json.load(f)
+    process(content, FIPS_COLUMNS, DIR, state)
 
-def request_to_df(r):
-    content = json.loads(r.content)
-    header = content[0]
-    data = content[1:]
-    return pd.DataFrame(data, columns=header)
 
+def main(states=None, levels=None, workers=WORKERS, base_url=BASE_URL, from_raw=False):
+    if states is None:
+        STATES = STATE_TO_FIPS.keys()
+    else:
+        STATES = [x.strip().lower() for x in states.split(",")]
 
-def main():
-    for (DIR, LEVEL, FUNC) in TYPES:
+    # Tables that already exist are skipped, so rerunning after a failure or
+    # an interruption only fetches what is missing. With from_raw, every table
+    # with a saved raw response is rebuilt from it instead, without the API.
+    jobs = []
+    for (DIR, LEVEL, FIPS_COLUMNS) in TYPES:
+        if levels is not None and Path(DIR).name not in levels.split(","):
+            continue
         Path(DIR).mkdir(parents=True, exist_ok=True)
-        for state, fips in STATE_TO_FIPS.items():
-            if not Path(f"{DIR}{state}.tsv").is_file():
-                s = (
-                    "https://api.census.gov/data/2016/acs/acs5/?get=NAME,"
-                    f"{','.join(CENSUS_VARS)}&for={LEVEL}:*&in=state:{fips}"
-                )
-                r = requests.get(s)
-                df = request_to_df(r)
-                df.loc[:, CENSUS_VARS] = df.loc[:, CENSUS_VARS].astype(int)
-                for label, indices in GROUPING.items():
-                    varnames = [CENSUS_VARS[idx] for idx in indices]
-                    df.loc[:, label] = df.loc[:, varnames].sum(axis=1)
+        for state in STATES:
+            if from_raw:
+                if Path(raw_path(DIR, state)).is_file():
+                    jobs.append((DIR, LEVEL, FIPS_COLUMNS, state))
+            elif not Path(f"{DIR}{state}.tsv").is_file():
+                jobs.append((DIR, LEVEL, FIPS_COLUMNS, state))
 
-                df = df.loc[:, ~df.columns.isin(CENSUS_VARS)]
-                df.loc[:, "FIPS"] = df.apply(FUNC, axis=1)
+    failures = []
+    session = make_session(workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if from_raw:
+            futures = {executor.submit(reprocess, *job): job for job in jobs}
+        else:
+            futures = {
+                executor.submit(collect, session, base_url.rstrip("/"), *job): job
+                for job in jobs
+            }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            DIR, _, _, state = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                failures.append(f"{DIR}{state}.tsv")
+                tqdm.write(f"Failed to collect {DIR}{state}.tsv: {e}")
 
-                df.to_csv(f"{DIR}{state}.tsv", sep="\t", index=False)
+    if failures:
+        raise SystemExit(
+            f"{len(failures)} of {len(jobs)} tables failed; rerun to retry them."
+        )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Download ACS population data by age for each state."
+    )
+    parser.add_argument(
+        "-s",
+        "--states",
+        action="store",
+        help="A comma-separated list of two-letter state USPS codes to "
+        "download. If this argument is absent, use all 50 states + DC.",
+        default=None,
+    )
+    parser.add_argument(
+        "-l",
+        "--levels",
+        action="store",
+        help="A comma-separated list of geographic levels to download "
+        "(county, town, tract). If this argument is absent, download all three.",
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        help="The number of tables to download at once.",
+        default=WORKERS,
+    )
+    parser.add_argument(
+        "-u",
+        "--base-url",
+        action="store",
+        help="The ACS 5-year API endpoint to query, e.g. a local stand-in "
+        "server for testing.",
+        default=BASE_URL,
+    )
+    parser.add_argument(
+        "-r",
+        "--from-raw",
+        action="store_true",
+        help="Rebuild the tables from the raw API responses saved by earlier "
+        "downloads, without querying the API.",
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    instrumentation.start(args)
+    main(args.states, args.levels, args.workers, args.base_url, args.from_raw)
+    instrumentation.report("data/raw/population_data/collect.profile.json")
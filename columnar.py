@@ -0,0 +1,161 @@
+import json
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+# A columnar table is a directory holding one .npy file per column plus a
+# manifest describing the columns. Numeric columns can be memory-mapped
+# straight from disk; string columns are stored as fixed-width ASCII bytes
+# where possible and fixed-width unicode otherwise. Missing values in string
+# and nullable integer columns are kept in a separate mask. Categorical
+# columns of strings keep their integer codes (-1 where missing) in the
+# column's file and their distinct values, stored like a string column, in a
+# second file, so they read back as categoricals of memory-mapped codes.
+
+MANIFEST = "manifest.json"
+
+
+def encode_strings(strings):
+    """Fixed-width ASCII bytes where possible, else unicode, and the encoding."""
+    strings = pd.Series(strings).astype(str).tolist()
+    try:
+        return np.array([s.encode("ascii") for s in strings], dtype=bytes), "ascii"
+    except UnicodeEncodeError:
+        return np.array(strings, dtype=str), None
+
+
+def write_table(df, path, meta=None):
+    """Write a data frame to `path` as a columnar table.
+
+    The table is written to a temporary directory and moved into place once
+    complete, so readers never see a partially written table.
+    """
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    columns = []
+    for i, (name, col) in enumerate(df.items()):
+        entry = {"name": name, "file": f"{i}.npy", "mask": None}
+        nulls = col.isna().to_numpy()
+
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            entry["kind"] = "category"
+            values = col.cat.codes.to_numpy()
+            entry["categories"] = f"{i}.categories.npy"
+            categories, entry["encoding"] = encode_strings(col.cat.categories)
+            np.save(tmp / entry["categories"], categories, allow_pickle=False)
+            nulls = None
+        elif pd.api.types.is_bool_dtype(col.dtype) or pd.api.types.is_float_dtype(
+            col.dtype
+        ):
+            entry["kind"] = "numeric"
+            values = col.to_numpy()
+            nulls = None
+        elif pd.api.types.is_integer_dtype(col.dtype):
+            entry["kind"] = "integer"
+            entry["dtype"] = str(col.dtype)
+            values = col.fillna(0).to_numpy(dtype=str(col.dtype).lower())
+        elif pd.api.types.is_object_dtype(col.dtype) or pd.api.types.is_string_dtype(
+            col.dtype
+        ):
+            entry["kind"] = "str"
+            values, encoding = encode_strings(col.fillna(""))
+            if encoding is not None:
+                entry["encoding"] = encoding
+        else:
+            raise TypeError(f"Cannot store column {name!r} of type {col.dtype}.")
+
+        np.save(tmp / entry["file"], values, allow_pickle=False)
+        if nulls is not None and nulls.any():
+            entry["mask"] = f"{i}.mask.npy"
+            np.save(tmp / entry["mask"], nulls, allow_pickle=False)
+        columns.append(entry)
+
+    with open(tmp / MANIFEST, "w") as f:
+        json.dump({"rows": len(df), "columns": columns, "meta": meta or {}}, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    tmp.rename(path)
+
+
+def read_manifest(path):
+    with open(Path(path) / MANIFEST) as f:
+        return json.load(f)
+
+
+def write_manifest(path, manifest):
+    tmp = Path(path) / (MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    tmp.replace(Path(path) / MANIFEST)
+
+
+def read_arrays(path, columns=None, mmap_mode="r"):
+    """Return the raw column arrays of a table, memory-mapped by default.
+
+    Missing values are not applied; use `read_table` for a data frame.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    arrays = {}
+    for entry in manifest["columns"]:
+        if columns is None or entry["name"] in columns:
+            arrays[entry["name"]] = np.load(path / entry["file"], mmap_mode=mmap_mode)
+    return arrays
+
+
+def decode_column(entry, values, mask, categories=None):
+    """Turn stored column values back into what `write_table` was given."""
+    if entry["kind"] == "category":
+        if entry.get("encoding") == "ascii":
+            categories = np.char.decode(categories, "ascii")
+        values = pd.Categorical.from_codes(
+            values, categories=pd.Index(categories.astype(object))
+        )
+    elif entry["kind"] == "str":
+        if entry.get("encoding") == "ascii":
+            values = np.char.decode(values, "ascii")
+        values = values.astype(object)
+        if mask is not None:
+            values[mask] = np.nan
+    elif entry["kind"] == "integer":
+        values = pd.Series(values).astype(entry["dtype"])
+        if mask is not None:
+            values = values.where(~mask)
+    return values
+
+
+def read_table(path, columns=None, mmap_mode="r", rows=None):
+    """Read a columnar table written by `write_table` into a data frame.
+
+    With `rows`, an array of row numbers, read only those rows; the columns
+    are memory-mapped, so only the pages holding them are read from disk.
+    """
+    path = Path(path)
+    manifest = read_manifest(path)
+    data = {}
+    for entry in manifest["columns"]:
+        if columns is not None and entry["name"] not in columns:
+            continue
+        values = np.load(path / entry["file"], mmap_mode=mmap_mode)
+        mask = None
+        if entry["mask"] is not None:
+            mask = np.load(path / entry["mask"], mmap_mode=mmap_mode)
+        if rows is not None:
+            values = values[rows]
+            mask = None if mask is None else mask[rows]
+        elif mask is not None:
+            mask = np.asarray(mask)
+        categories = None
+        if entry["kind"] == "category":
+            categories = np.load(path / entry["categories"])
+        data[entry["name"]] = decode_column(entry, values, mask, categories)
+
+    names = [e["name"] for e in manifest["columns"]]
+    if columns is not None:
+        names = [name for name in names if name in columns]
+    length = manifest["rows"] if rows is None else len(rows)
+    return pd.DataFrame(data, columns=names, index=pd.RangeIndex(length))
@@ -0,0 +1,218 @@
+import argparse
+import json
+from pathlib import Path
+import construct_block_network
+import construct_county_network
+import construct_lodes_network
+import construct_town_network
+import construct_tract_network
+import instrumentation
+import result_cache
+from lodes_partitions import read_flows
+from lodes_store import parse_segment, parse_segments, segment_columns
+import threshold_sweep
+
+# Builds many networks in one process, reading each input once. A spec file
+# lists the networks as JSON objects:
+#
+#   [
+#     {"level": "tract", "states": "ma,ri", "minimum_weight": 10, "output": "a"},
+#     {"level": "tract", "states": null, "minimum_weight": 50, "output": "b"},
+#     {"level": "county", "states": ["ct", "ny"], "output": "c",
+#      "formats": ["graphml", "bundle"], "backend": "csr"}
+#   ]
+#
+# "level" is one of LEVELS, and the other keys are the options of the level's
+# script (states as a list or a comma-separated string, null for all of them;
+# thresholds as a list of minimum weights for a sweep, see threshold_sweep.py).
+# The networks of a level share one read of their flows: the ACS workbook, the
+# national LODES partitions, or, for blocks, the OD tables of every state
+# named at the lowest minimum weight asked for. Each network is then filtered
+# from the shared flows and written exactly as its own script run would.
+
+LEVELS = ["county", "town", "tract", "block", "lodes_county", "lodes_state"]
+MODULES = {
+    "county": construct_county_network,
+    "town": construct_town_network,
+    "tract": construct_tract_network,
+    "block": construct_block_network,
+    "lodes_county": construct_lodes_network,
+    "lodes_state": construct_lodes_network,
+}
+DEFAULTS = {
+    "states": None,
+    "minimum_weight": 0,
+    "output": None,
+    "backend": "networkx",
+    "formats": ["graphml"],
+    "geographies": None,
+    "thresholds": None,
+    "summary_only": False,
+    "segments": None,
+    "weight_segment": None,
+}
+
+
+def read_spec(path):
+    """The jobs of a spec file, with every option filled in."""
+    with open(path) as f:
+        spec = json.load(f)
+
+    jobs = []
+    outputs = set()
+    for job in spec:
+        if job.get("level") not in LEVELS:
+            raise ValueError(f"Unknown level in {job}; use one of {LEVELS}.")
+        unknown = set(job) - set(DEFAULTS) - {"level"}
+        if unknown:
+            raise ValueError(f"Unknown options {sorted(unknown)} in {job}.")
+        if job.get("geographies") is not None and job["level"] != "block":
+            raise ValueError(f"Only block networks take geographies: {job}.")
+        segmented = job.get("segments") or job.get("weight_segment")
+        if segmented and job["level"] in ["county", "town"]:
+            raise ValueError(f"Only LODES networks have job segments: {job}.")
+        if job.get("thresholds") is not None and job.get("minimum_weight"):
+            raise ValueError(f"Thresholds replace the minimum weight: {job}.")
+        job = {**DEFAULTS, **job}
+        if isinstance(job["states"], list):
+            job["states"] = ",".join(job["states"])
+        if isinstance(job["formats"], str):
+            job["formats"] = job["formats"].split(",")
+        if isinstance(job["thresholds"], list):
+            job["thresholds"] = ",".join(str(x) for x in job["thresholds"])
+        if isinstance(job["segments"], list):
+            job["segments"] = ",".join(job["segments"])
+        job["segments"] = parse_segments(job["segments"])
+        job["weight_segment"] = parse_segment(job["weight_segment"])
+        if isinstance(job["geographies"], list):
+            job["geographies"] = ",".join(job["geographies"])
+        if (job["level"], job["output"]) in outputs:
+            raise ValueError(
+                f"More than one {job['level']} network is written to "
+                f"{job['output'] or 'data/derived'}."
+            )
+        outputs.add((job["level"], job["output"]))
+        jobs.append(job)
+    return jobs
+
+
+def load(level, jobs):
+    """The flows shared by the networks of `level` in `jobs`."""
+    if level in ["county", "town"]:
+        return MODULES[level].load_flows()
+    columns = []
+    for job in jobs:
+        columns += segment_columns(job["segments"], job["weight_segment"])
+    columns = list(dict.fromkeys(columns))
+    if level == "tract":
+        return read_flows("tract", None, columns)
+    if level.startswith("lodes_"):
+        return read_flows(level[len("lodes_") :], None, columns)
+
+    # Blocks are read state by state, as the block script reads them, and
+    # filtered on their weight while they are read, so the networks weighted
+    # by each segment get flows of their own.
+    flows = {}
+    for weight_segment in dict.fromkeys(job["weight_segment"] for job in jobs):
+        weighted = [job for job in jobs if job["weight_segment"] == weight_segment]
+        states = set()
+        for job in weighted:
+            if job["states"] is None:
+                states.update(construct_block_network.ALL_STATES)
+            else:
+                states.update(x.strip().lower() for x in job["states"].split(","))
+        minimum_weight = min(
+            int(job["minimum_weight"])
+            if job["thresholds"] is None
+            else min(threshold_sweep.parse_thresholds(job["thresholds"]))
+            for job in weighted
+        )
+        segments = list(
+            dict.fromkeys(column for job in weighted for column in job["segments"])
+        )
+        flows[weight_segment] = {
+            state: construct_block_network.read_flows(
+                state,
+                minimum_weight,
+                segments=segments,
+                weight_segment=weight_segment,
+            )
+            for state in sorted(states)
+        }
+    return flows
+
+
+def arguments(level, job, flows=None):
+    """The arguments of the construct_network call that builds `job`."""
+    args = [job["states"], job["minimum_weight"], job["output"]]
+    if level.startswith("lodes_"):
+        args.insert(0, level[len("lodes_") :])
+    if level == "block" and flows is not None:
+        flows = flows[job["weight_segment"]]
+    kwargs = {
+        "backend": job["backend"],
+        "formats": job["formats"],
+        "flows": flows,
+        "thresholds": threshold_sweep.parse_thresholds(job["thresholds"]),
+        "summary_only": job["summary_only"],
+    }
+    if level not in ["county", "town"]:
+        kwargs["segments"] = job["segments"]
+        kwargs["weight_segment"] = job["weight_segment"]
+    if level == "block" and job["geographies"] is not None:
+        kwargs["geographies"] = construct_block_network.parse_geographies(
+            job["geographies"]
+        )
+    return args, kwargs
+
+
+def main(spec, cache=False):
+    jobs = read_spec(spec)
+    for level in LEVELS:
+        construct = MODULES[level].construct_network
+        level_jobs = []
+        for job in jobs:
+            if job["level"] != level:
+                continue
+            if cache:
+                args, kwargs = arguments(level, job)
+                digest, signature, options = result_cache.lookup(
+                    level, construct, *args, **kwargs
+                )
+                if result_cache.restore(level, options, digest):
+                    print(f"{level} network in data/derived/{job['output'] or ''}")
+                    print(f"restored from the cache ({digest[:12]})")
+                    continue
+                job = {**job, "cached": (digest, signature, options)}
+            level_jobs.append(job)
+        # Only read the flows if some network isn't in the cache.
+        if not level_jobs:
+            continue
+        with instrumentation.stage(f"load {level} flows"):
+            flows = load(level, level_jobs)
+        for job in level_jobs:
+            print(f"{level} network in data/derived/{job['output'] or ''}")
+            args, kwargs = arguments(level, job, flows)
+            construct(*args, **kwargs)
+            if cache:
+                digest, signature, options = job["cached"]
+                result_cache.save(level, options, digest, signature)
+        del flows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Construct many commuter networks, reading each input once."
+    )
+    parser.add_argument(
+        "spec",
+        help="A JSON file listing the networks to build (see the top of "
+        "construct_batch.py).",
+    )
+    result_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    instrumentation.start(args)
+    main(args.spec, args.cache)
+    instrumentation.report(Path("data/derived/batch.profile.json"))
@@ -1,95 +1,197 @@
-import glob
+import numpy as np
 import pandas as pd
 import argparse
-import networkx as nx
 from pathlib import Path
+from csr_network import BACKENDS, build_network, set_node_table
+from geocodes import format_geocodes, in_geographies, truncate
+from geography_store import open_table
+import instrumentation
+from lodes_store import (
+    add_segment_arguments,
+    od_chunks,
+    parse_segment,
+    parse_segments,
+)
+from network_bundle import FORMATS, write_network
+import result_cache
+import threshold_sweep
+from state_fips_mapping import STATE_TO_FIPS
 
+CHUNKSIZE = 1000000
+# fmt: off
+ALL_STATES = [
+    "ak", "al", "ar", "az", "ca", "co", "ct", "dc", "de", "fl",
+    "ga", "hi", "ia", "id", "il", "in", "ks", "ky", "la", "ma",
+    "md", "me", "mi", "mn", "mo", "ms", "mt", "nc", "nd", "ne",
+    "nh", "nj", "nm", "nv", "ny", "oh", "ok", "or", "pa", "ri",
+    "sc", "sd", "tn", "tx", "ut", "va", "vt", "wa", "wi", "wv",
+    "wy",
+]
+# fmt: on
 
-def construct_network(states, minimum_weight, output):
-    if states is None:
-        # fmt: off
-        STATES = [
-            "ak", "al", "ar", "az", "ca", "co", "ct", "dc", "de", "fl",
-            "ga", "hi", "ia", "id", "il", "in", "ks", "ky", "la", "ma",
-            "md", "me", "mn", "mo", "ms", "mt", "nc", "nd", "ne", "nh",
-            "nj", "nm", "nm", "nv", "ny", "oh", "ok", "or", "pa", "ri",
-            "sc", "sd", "tn", "tx", "ut", "va", "vt", "wa", "wi", "wv",
-            "wy",
-        ]
-        # fmt: on
-    else:
-        STATES = [x.strip().lower() for x in states.split(",")]
 
-    metadatas = []
-    dfs = []
-    for state in STATES:
-        metadata = pd.read_csv(
-            f"data/raw/LODES7/{state}/{state}_xwalk.csv.gz",
-            sep=",",
-            usecols=[
-                "tabblk2010",
-                "st",
-                "cty",
-                "trct",
-                "zcta",
-                "stname",
-                "stusps",
-                "ctyname",
-                "trctname",
-                "blklatdd",
-                "blklondd",
-            ],
-            compression="gzip",
-            encoding="latin-1",
-            dtype="str",
-        )
+def parse_geographies(geographies):
+    """FIPS prefixes from a comma-separated list of USPS codes or FIPS codes."""
+    prefixes = []
+    for x in geographies.split(","):
+        x = x.strip().lower()
+        prefixes.append(STATE_TO_FIPS[x] if x in STATE_TO_FIPS else x)
+    return prefixes
 
-        metadatas.append(metadata)
 
-        files = glob.glob(f"data/raw/LODES7/{state}/od/{state}_od_*_JT00_2016.csv.gz")
+def read_flows(
+    state,
+    minimum_weight,
+    geographies=None,
+    chunksize=CHUNKSIZE,
+    segments=(),
+    weight_segment=None,
+):
+    """Read a state's OD tables, keeping only the rows that pass the filters.
 
-        for fname in files:
-            df = pd.read_csv(
-                fname,
-                sep=",",
-                usecols=["w_geocode", "h_geocode", "S000"],
-                compression="gzip",
-                encoding="latin-1",
-                dtype={"w_geocode": "str", "h_geocode": "str", "S000": "Int64"},
-            ).rename(
-                columns={"w_geocode": "target", "h_geocode": "source", "S000": "weight"}
+    The tables are memory-mapped from the LODES store and filtered a slice at
+    a time, so memory use follows the rows kept rather than the table size.
+    Rows need at least `minimum_weight` jobs (of `weight_segment`, if given)
+    and, if `geographies` (a list of FIPS prefixes) is given, both blocks
+    inside one of the geographies. Returns, for each OD table, the kept rows,
+    with the geocodes as integers and a column for each of `segments`, the
+    number of rows read and their total weight.
+    """
+    weight_column = "S000" if weight_segment is None else weight_segment
+    columns = ["w_geocode", "h_geocode", weight_column]
+    columns += [column for column in segments if column != weight_column]
+    kept = {}
+    rows = {}
+    totals = {}
+    for part, arrays in od_chunks(state, chunksize, columns):
+        target = arrays["w_geocode"]
+        source = arrays["h_geocode"]
+        weight = arrays[weight_column]
+        keep = weight >= minimum_weight
+        if geographies is not None:
+            keep &= in_geographies(source, "block", geographies)
+            keep &= in_geographies(target, "block", geographies)
+        rows[part] = rows.get(part, 0) + len(weight)
+        totals[part] = totals.get(part, 0) + int(weight.sum(dtype=np.int64))
+        kept.setdefault(part, []).append(
+            pd.DataFrame(
+                {
+                    "target": target[keep],
+                    "source": source[keep],
+                    "weight": pd.array(weight[keep], dtype="Int64"),
+                    **{
+                        column: pd.array(arrays[column][keep], dtype="Int64")
+                        for column in segments
+                    },
+                }
             )
+        )
+    return {
+        part: (pd.concat(dfs, axis=0, ignore_index=True), rows[part], totals[part])
+        for part, dfs in kept.items()
+    }
 
-            dfs.append(df)
 
-    df = pd.concat(dfs, axis=0, ignore_index=True)
-    metadata = pd.concat(metadatas, axis=0, ignore_index=True)
-    del dfs
-    del metadatas
+def filter_flows(flows, minimum_weight, geographies=None):
+    """Narrow the result of read_flows to the rows that pass stricter filters."""
+    kept = {}
+    for part, (df, rows, total) in flows.items():
+        keep = (df["weight"] >= minimum_weight).to_numpy(dtype=bool)
+        if geographies is not None:
+            keep &= in_geographies(df["source"].to_numpy(), "block", geographies)
+            keep &= in_geographies(df["target"].to_numpy(), "block", geographies)
+        kept[part] = (df.loc[keep, :].reset_index(drop=True), rows, total)
+    return kept
 
-    df = df.loc[df["weight"] >= int(minimum_weight), :]
-    G = nx.from_pandas_edgelist(
-        df, "source", "target", edge_attr=["weight"], create_using=nx.DiGraph()
-    )
-    del df
 
-    state_dict = metadata.set_index("tabblk2010")["stname"].to_dict()
-    county_dict = metadata.set_index("tabblk2010")["ctyname"].to_dict()
-    tract_dict = metadata.set_index("tabblk2010")["trctname"].to_dict()
-    lat_dict = metadata.set_index("tabblk2010")["blklatdd"].to_dict()
-    long_dict = metadata.set_index("tabblk2010")["blklondd"].to_dict()
+def construct_network(
+    states,
+    minimum_weight,
+    output,
+    backend="networkx",
+    formats=("graphml",),
+    geographies=None,
+    flows=None,
+    thresholds=None,
+    summary_only=False,
+    segments=(),
+    weight_segment=None,
+):
+    """Build and write the network.
 
-    nx.set_node_attributes(G, state_dict, "state")
-    nx.set_node_attributes(G, county_dict, "county")
-    nx.set_node_attributes(G, tract_dict, "tract")
-    nx.set_node_attributes(G, lat_dict, "latitude")
-    nx.set_node_attributes(G, long_dict, "longitude")
+    If given, `flows` holds each state's read_flows at a minimum weight no
+    higher than `minimum_weight`, with the same weight segment and at least
+    the same segments, and the state's rows are filtered from it rather than
+    read again.
+    """
+    if thresholds is not None:
+        # Build at the lowest threshold, and derive the others from it.
+        minimum_weight = min(thresholds)
+        backend = "csr"
+    if states is None:
+        STATES = ALL_STATES
+    else:
+        STATES = [x.strip().lower() for x in states.split(",")]
+
+    dfs = []
+    rows_in = 0
+    total_in = 0
+    with instrumentation.stage("read flows") as record:
+        for state in STATES:
+            if flows is None:
+                parts = read_flows(
+                    state,
+                    int(minimum_weight),
+                    geographies,
+                    segments=segments,
+                    weight_segment=weight_segment,
+                )
+            else:
+                parts = filter_flows(flows[state], int(minimum_weight), geographies)
+            for part, (df, rows, total) in parts.items():
+                print(f"{state}_od_{part}: kept {len(df):,} of {rows:,} rows")
+                rows_in += rows
+                total_in += total
+                dfs.append(df)
+
+        df = pd.concat(dfs, axis=0, ignore_index=True)
+        del dfs
+        record["rows"] = rows_in
+    print(f"Total: kept {len(df):,} of {rows_in:,} rows")
+
+    # Attributes are looked up for the blocks in the network only, and only
+    # for those in the selected states, whose crosswalks describe them.
+    blocks = pd.unique(np.concatenate([df["source"], df["target"]]))
+    blocks = blocks[
+        in_geographies(blocks, "block", [STATE_TO_FIPS[s] for s in STATES])
+    ]
+    locations = open_table("block", "coordinates").lookup(blocks)
+    tracts = truncate(locations.index.to_numpy(), "block", "tract")
+    metadata = open_table("tract", "names").take(tracts)
+    metadata["latitude"] = locations["latitude"].to_numpy()
+    metadata["longitude"] = locations["longitude"].to_numpy()
+    metadata.index = format_geocodes(locations.index, "block")
+
+    df["source"] = format_geocodes(df["source"], "block")
+    df["target"] = format_geocodes(df["target"], "block")
+    G = build_network(df, "source", "target", ["weight"] + list(segments), backend)
+    del df
+
+    set_node_table(G, metadata)
 
     if output is None:
-        nx.write_graphml(G, "data/derived/block_commuter_flows.graphml")
+        stem = "data/derived/block_commuter_flows"
     else:
         Path(f"data/derived/{output}").mkdir(parents=True, exist_ok=True)
-        nx.write_graphml(G, f"data/derived/{output}/block_commuter_flows.graphml")
+        stem = f"data/derived/{output}/block_commuter_flows"
+    if thresholds is None:
+        write_network(G, stem, formats)
+    else:
+        threshold_sweep.write_sweep(
+            G, stem, thresholds, formats, summary_only, total_in
+        )
+
+    return G
 
 
 if __name__ == "__main__":
@@ -120,6 +222,59 @@ if __name__ == "__main__":
         "this is higher, the resulting graph will be sparser.",
         default=0,
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="How to hold the network in memory. The csr backend stores edges "
+        "as compact integer arrays, which the largest networks need in order "
+        "to fit in memory.",
+        default="networkx",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        action="store",
+        help=f"A comma-separated list of output formats ({', '.join(FORMATS)}). A "
+        "bundle is a binary columnar directory that network_bundle.load_network "
+        "loads much faster than GraphML. If this argument is absent, write "
+        "GraphML only.",
+        default="graphml",
+    )
+    parser.add_argument(
+        "-g",
+        "--geographies",
+        action="store",
+        help="A comma-separated list of USPS state codes or FIPS codes (e.g. "
+        "25 or 25025 for a county). If present, keep only edges with both "
+        "blocks inside these geographies, e.g. to drop commuters from other "
+        "states.",
+        default=None,
+    )
 
+    threshold_sweep.add_arguments(parser)
+    add_segment_arguments(parser)
+    result_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
-    construct_network(args.states, args.minimum_weight, args.output)
+    threshold_sweep.check_arguments(parser, args)
+    instrumentation.start(args)
+    construct = construct_network
+    if args.cache:
+        construct = result_cache.cached("block", construct_network)
+    construct(
+        args.states,
+        args.minimum_weight,
+        args.output,
+        args.backend,
+        [x.strip() for x in args.formats.split(",")],
+        None if args.geographies is None else parse_geographies(args.geographies),
+        thresholds=threshold_sweep.parse_thresholds(args.thresholds),
+        summary_only=args.summary_only,
+        segments=parse_segments(args.segments),
+        weight_segment=parse_segment(args.weight_segment),
+    )
+    instrumentation.report(
+        Path("data/derived", args.output or "", "block_commuter_flows.profile.json")
+    )
@@ -1,8 +1,14 @@
-import networkx as nx
 import pandas as pd
 import argparse
 from pathlib import Path
 from state_fips_mapping import STATE_TO_FIPS
+from acs_flows import read_flow_table
+from csr_network import BACKENDS, build_network, set_node_attributes
+from geography_store import open_table
+import instrumentation
+from network_bundle import FORMATS, write_network
+import result_cache
+import threshold_sweep
 
 # This script uses the following data files:
 #
@@ -13,62 +19,30 @@ from state_fips_mapping import STATE_TO_FIPS
 SCHEMA = {
     "source_state_fips_code": str,
     "source_county_fips_code": str,
-    "source_state_name": str,
-    "source_county_name": str,
+    "source_state_name": "category",
+    "source_county_name": "category",
     "target_state_fips_code": str,
     "target_county_fips_code": str,
-    "target_state_name": str,
-    "target_county_name": str,
+    "target_state_name": "category",
+    "target_county_name": "category",
     "weight": "Int64",
     "margin": str,
 }
 
 
-def parseint(s):
-    try:
-        return int(s)
-    except ValueError:
-        s = s.replace(",", "")
-        return int(s)
-
-
 def construct_fips(state, county):
     return state + county
 
 
-def construct_network(states, minimum_weight, output):
-    df = pd.read_excel(
-        "data/raw/table1.xlsx",
-        skiprows=7,
-        header=None,
-        names=SCHEMA.keys(),
-        dtype=SCHEMA,
-    )
-    df = df.loc[pd.notnull(df["weight"]), :]
-
-    gazetteer = pd.read_csv(
-        "data/raw/2019_Gaz_counties_national.txt", sep="\t", dtype={"GEOID": str},
-    )
-    gazetteer.columns = [x.strip() for x in gazetteer.columns]
-    gazetteer = gazetteer.loc[:, ["GEOID", "INTPTLONG", "INTPTLAT"]]
-
-    source_gazetteer = gazetteer.rename(
-        {
-            "INTPTLONG": "source_longitude",
-            "INTPTLAT": "source_latitude",
-            "GEOID": "source_fips",
-        },
-        axis=1,
-    )
+def load_flows():
+    """Read table1 and keep the flows between the 50 states + DC.
 
-    target_gazetteer = gazetteer.rename(
-        {
-            "INTPTLONG": "target_longitude",
-            "INTPTLAT": "target_latitude",
-            "GEOID": "target_fips",
-        },
-        axis=1,
-    )
+    This is the part of a build that doesn't depend on the states or the
+    minimum weight, so a batch build does it once for all of its networks.
+    """
+    with instrumentation.stage("read flow table") as record:
+        df = read_flow_table("data/raw/table1.xlsx", SCHEMA)
+        record["rows"] = len(df)
 
     # restrict nodes to the 50 states + DC
     df = df.loc[0 < df["target_state_fips_code"].astype(float), :]
@@ -79,65 +53,11 @@ def construct_network(states, minimum_weight, output):
     # Strip initial zero in state FIPS codes for target. The spreadsheet
     # has state FIPS as a three-digit number to allow for Canada.
     df["target_state_fips_code"] = df["target_state_fips_code"].str[1:]
+    return df
 
-    # Restrict to the desired states
-    if states is not None:
-        STATES = [x.strip().lower() for x in states.split(",")]
-        STATE_FIPS = [STATE_TO_FIPS[x] for x in STATES]
-        df = df.loc[df["target_state_fips_code"].isin(STATE_FIPS), :]
-        df = df.loc[df["source_state_fips_code"].isin(STATE_FIPS), :]
-    else:
-        STATES = STATE_TO_FIPS.keys()
-
-    pop_metadatas = []
-    for state in STATES:
-        pop = pd.read_csv(
-            f"data/raw/population_data/county/{state}.tsv",
-            sep="\t",
-            dtype={"FIPS": "str"},
-        )
-        pop_metadatas.append(pop)
-    pop_metadata = pd.concat(pop_metadatas, axis=0, ignore_index=True)
-    del pop_metadatas
-
-    df["weight"] = df["weight"].apply(parseint)
-    df["margin"] = df["margin"].apply(parseint)
-
-    df = df.loc[df["weight"] >= int(minimum_weight), :]
-
-    # Simple concatenation of component FIPS codes.
-    df["source_fips"] = df.apply(
-        lambda row: construct_fips(
-            row.source_state_fips_code, row.source_county_fips_code,
-        ),
-        axis=1,
-    )
-
-    df["target_fips"] = df.apply(
-        lambda row: construct_fips(
-            row.target_state_fips_code, row.target_county_fips_code,
-        ),
-        axis=1,
-    )
-
-    df = df.loc[df["source_fips"].apply(lambda s: len(s) == 5), :]
-    df = df.loc[df["target_fips"].apply(lambda s: len(s) == 5), :]
-
-    df = df.merge(pop_metadata, "left", left_on="target_fips", right_on="FIPS")
-    del pop_metadata
-
-    df = df.merge(source_gazetteer, how="left", on="source_fips")
-    df = df.merge(target_gazetteer, how="left", on="target_fips")
-
-    # Construct the graph with edge attributes.
-    G = nx.from_pandas_edgelist(
-        df,
-        "source_fips",
-        "target_fips",
-        edge_attr=["weight", "margin"],
-        create_using=nx.DiGraph(),
-    )
 
+def add_node_attributes(G, df, gazetteer):
+    """Set the attributes of the nodes of `G` from the rows it was built from."""
     # Node attributes are a bit trickier. It's unlikely, but just to make sure
     # we don't miss any metadata, we combine the source and target information
     # about locations.
@@ -155,8 +75,9 @@ def construct_network(states, minimum_weight, output):
             {"source_state_name": "state", "source_county_name": "county",}, axis=1,
         )
     )
-    lat_dict = gazetteer.set_index("GEOID")["INTPTLAT"].to_dict()
-    long_dict = gazetteer.set_index("GEOID")["INTPTLONG"].to_dict()
+    locations = gazetteer.lookup(pd.unique(df[["source_fips", "target_fips"]].stack()))
+    lat_dict = locations["latitude"].to_dict()
+    long_dict = locations["longitude"].to_dict()
 
     state_dict = target_attr_df["state"].to_dict()
     state_dict.update(source_attr_df["state"].to_dict())
@@ -166,10 +87,10 @@ def construct_network(states, minimum_weight, output):
     # With the node attribute dicts created, we can set node attributes and
     # then write to files.
 
-    nx.set_node_attributes(G, state_dict, "state")
-    nx.set_node_attributes(G, county_dict, "county")
-    nx.set_node_attributes(G, lat_dict, "latitude")
-    nx.set_node_attributes(G, long_dict, "longitude")
+    set_node_attributes(G, state_dict, "state")
+    set_node_attributes(G, county_dict, "county")
+    set_node_attributes(G, lat_dict, "latitude")
+    set_node_attributes(G, long_dict, "longitude")
 
     for pop in [
         "Population",
@@ -186,19 +107,96 @@ def construct_network(states, minimum_weight, output):
         "65+",
     ]:
         d = df.set_index("target_fips").loc[:, pop].to_dict()
-        nx.set_node_attributes(G, d, pop)
+        set_node_attributes(G, d, pop)
+
+
+def construct_network(
+    states,
+    minimum_weight,
+    output,
+    backend="networkx",
+    formats=("graphml",),
+    flows=None,
+    thresholds=None,
+    summary_only=False,
+):
+    """Build and write the network; `flows` is the result of load_flows, if loaded."""
+    if thresholds is not None:
+        # Build at the lowest threshold, and derive the others from it.
+        minimum_weight = min(thresholds)
+        backend = "csr"
+    df = load_flows() if flows is None else flows
+
+    gazetteer = open_table("county", "gazetteer")
+    population = open_table("county", "population")
+
+    # Restrict to the desired states
+    if states is not None:
+        STATES = [x.strip().lower() for x in states.split(",")]
+        STATE_FIPS = [STATE_TO_FIPS[x] for x in STATES]
+        df = df.loc[df["target_state_fips_code"].isin(STATE_FIPS), :]
+        df = df.loc[df["source_state_fips_code"].isin(STATE_FIPS), :]
+
+    df = df.assign(weight=df["weight"].astype(int), margin=df["margin"].astype(int))
+
+    total = df["weight"].sum()
+    df = df.loc[df["weight"] >= int(minimum_weight), :]
+
+    # Simple concatenation of component FIPS codes.
+    df["source_fips"] = construct_fips(
+        df["source_state_fips_code"], df["source_county_fips_code"]
+    )
+    df["target_fips"] = construct_fips(
+        df["target_state_fips_code"], df["target_county_fips_code"]
+    )
+
+    df = df.loc[df["source_fips"].str.len() == 5, :]
+    df = df.loc[df["target_fips"].str.len() == 5, :]
+
+    # Join the population of the target and the location of both ends, in
+    # the same columns a merge with the source tables would give.
+    with instrumentation.stage("join attributes", rows=len(df)):
+        df = pd.concat(
+            [
+                df.reset_index(drop=True),
+                population.take(df["target_fips"]),
+                gazetteer.take(df["source_fips"]).add_prefix("source_"),
+                gazetteer.take(df["target_fips"]).add_prefix("target_"),
+            ],
+            axis=1,
+        )
+
+    # Construct the graph with edge attributes.
+    G = build_network(
+        df, "source_fips", "target_fips", ["weight", "margin"], backend
+    )
+
+    add_node_attributes(G, df, gazetteer)
 
     if output is None:
-        df.to_csv("data/derived/county_commuter_flows.tsv", sep="\t", index=False)
-        nx.write_graphml(G, "data/derived/county_commuter_flows.graphml")
+        stem = "data/derived/county_commuter_flows"
     else:
         Path(f"data/derived/{output}").mkdir(parents=True, exist_ok=True)
-        df.to_csv(
-            f"data/derived/{output}/county_commuter_flows.tsv",
-            sep="\t",
-            index=False,
+        stem = f"data/derived/{output}/county_commuter_flows"
+    if thresholds is not None:
+
+        def prepare(network, threshold):
+            # The attributes and rows of a build at this threshold.
+            rows = df.loc[df["weight"] >= threshold, :]
+            add_node_attributes(network, rows, gazetteer)
+            if not summary_only:
+                with instrumentation.stage("write tsv", rows=len(rows)):
+                    rows.to_csv(f"{stem}_m{threshold}.tsv", sep="\t", index=False)
+
+        threshold_sweep.write_sweep(
+            G, stem, thresholds, formats, summary_only, total, prepare
         )
-        nx.write_graphml(G, f"data/derived/{output}/county_commuter_flows.graphml")
+        return G
+    with instrumentation.stage("write tsv", rows=len(df)):
+        df.to_csv(f"{stem}.tsv", sep="\t", index=False)
+    write_network(G, stem, formats)
+
+    return G
 
 
 if __name__ == "__main__":
@@ -229,5 +227,44 @@ if __name__ == "__main__":
         "this is higher, the resulting graph will be sparser.",
         default=0,
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="How to hold the network in memory. The csr backend stores edges "
+        "as compact integer arrays, which the largest networks need in order "
+        "to fit in memory.",
+        default="networkx",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        action="store",
+        help=f"A comma-separated list of output formats ({', '.join(FORMATS)}). A "
+        "bundle is a binary columnar directory that network_bundle.load_network "
+        "loads much faster than GraphML. If this argument is absent, write "
+        "GraphML only.",
+        default="graphml",
+    )
+    threshold_sweep.add_arguments(parser)
+    result_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
-    construct_network(args.states, args.minimum_weight, args.output)
+    threshold_sweep.check_arguments(parser, args)
+    instrumentation.start(args)
+    construct = construct_network
+    if args.cache:
+        construct = result_cache.cached("county", construct_network)
+    construct(
+        args.states,
+        args.minimum_weight,
+        args.output,
+        args.backend,
+        [x.strip() for x in args.formats.split(",")],
+        thresholds=threshold_sweep.parse_thresholds(args.thresholds),
+        summary_only=args.summary_only,
+    )
+    instrumentation.report(
+        Path("data/derived", args.output or "", "county_commuter_flows.profile.json")
+    )
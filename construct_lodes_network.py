@@ -0,0 +1,177 @@
+import argparse
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from csr_network import BACKENDS, build_network, set_node_attributes
+from geocodes import format_geocodes
+from geography_store import BANDS, open_table
+import instrumentation
+from lodes_partitions import read_flows, select_flows
+from lodes_store import (
+    add_segment_arguments,
+    parse_segment,
+    parse_segments,
+    segment_columns,
+)
+from network_bundle import FORMATS, write_network
+import result_cache
+import threshold_sweep
+
+# County and state commuter networks from LODES, rolled up from the block
+# flows by aggregate_lodes_tract_level.py. Unlike the ACS-based county
+# network, these count all primary and secondary jobs, as the tract and block
+# networks do.
+
+LEVELS = ["county", "state"]
+
+
+def construct_network(
+    level,
+    states,
+    minimum_weight,
+    output,
+    backend="networkx",
+    formats=("graphml",),
+    flows=None,
+    thresholds=None,
+    summary_only=False,
+    segments=(),
+    weight_segment=None,
+):
+    """Build and write the network; `flows` is all of read_flows(level), if read."""
+    if thresholds is not None:
+        # Build at the lowest threshold, and derive the others from it.
+        minimum_weight = min(thresholds)
+        backend = "csr"
+    if states is not None:
+        states = [x.strip().lower() for x in states.split(",")]
+    with instrumentation.stage("read flows") as record:
+        if flows is None:
+            columns = segment_columns(segments, weight_segment)
+            flow = read_flows(level, states, columns)
+        else:
+            flow = select_flows(flows, level, states)
+        if weight_segment is not None:
+            flow["weight"] = flow[weight_segment]
+        total = flow["weight"].sum()
+        flow = flow.loc[flow["weight"] >= int(minimum_weight), :]
+        record["rows"] = len(flow)
+
+    nodes = pd.unique(np.concatenate([flow["source"], flow["target"]]))
+    flow["source"] = format_geocodes(flow["source"], level)
+    flow["target"] = format_geocodes(flow["target"], level)
+    G = build_network(flow, "source", "target", ["weight"] + list(segments), backend)
+    del flow
+
+    fips = format_geocodes(nodes, level)
+    names = open_table(level, "names").lookup(fips)
+    pop = open_table(level, "population").lookup(fips)
+
+    set_node_attributes(G, names["state"].to_dict(), "state")
+    if level == "county":
+        locations = open_table("county", "gazetteer").lookup(fips)
+        set_node_attributes(G, names["county"].to_dict(), "county")
+        set_node_attributes(G, locations["latitude"].to_dict(), "latitude")
+        set_node_attributes(G, locations["longitude"].to_dict(), "longitude")
+    for band in BANDS:
+        set_node_attributes(G, pop[band].to_dict(), band)
+
+    if output is None:
+        stem = f"data/derived/lodes_{level}_commuter_flows"
+    else:
+        Path(f"data/derived/{output}").mkdir(parents=True, exist_ok=True)
+        stem = f"data/derived/{output}/lodes_{level}_commuter_flows"
+    if thresholds is None:
+        write_network(G, stem, formats)
+    else:
+        threshold_sweep.write_sweep(
+            G, stem, thresholds, formats, summary_only, total
+        )
+
+    return G
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Construct county- or state-level commuter networks from "
+        "LODES."
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        action="store",
+        choices=LEVELS,
+        help="The level of the network.",
+        default="county",
+    )
+    parser.add_argument(
+        "-s",
+        "--states",
+        action="store",
+        help="A comma-separated list of two-letter state USPS codes to include "
+        "in the network. If this argument is absent use all 50 states + DC.",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="The name of a subfolder of data/derived to save to. If this "
+        "argument is absent, save to data/derived directly",
+        default=None,
+    )
+    parser.add_argument(
+        "-m",
+        "--minimum-weight",
+        action="store",
+        help="The minimum number of jobs required to keep an edge. Where "
+        "this is higher, the resulting graph will be sparser.",
+        default=0,
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="How to hold the network in memory. The csr backend stores edges "
+        "as compact integer arrays.",
+        default="networkx",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        action="store",
+        help=f"A comma-separated list of output formats ({', '.join(FORMATS)}). "
+        "If this argument is absent, write GraphML only.",
+        default="graphml",
+    )
+
+    threshold_sweep.add_arguments(parser)
+    add_segment_arguments(parser)
+    result_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+    threshold_sweep.check_arguments(parser, args)
+    instrumentation.start(args)
+    construct = construct_network
+    if args.cache:
+        construct = result_cache.cached(f"lodes_{args.level}", construct_network)
+    construct(
+        args.level,
+        args.states,
+        args.minimum_weight,
+        args.output,
+        args.backend,
+        [x.strip() for x in args.formats.split(",")],
+        thresholds=threshold_sweep.parse_thresholds(args.thresholds),
+        summary_only=args.summary_only,
+        segments=parse_segments(args.segments),
+        weight_segment=parse_segment(args.weight_segment),
+    )
+    instrumentation.report(
+        Path(
+            "data/derived",
+            args.output or "",
+            f"lodes_{args.level}_commuter_flows.profile.json",
+        )
+    )
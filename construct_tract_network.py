@@ -1,76 +1,71 @@
+import numpy as np
 import pandas as pd
-import networkx as nx
-import glob
 import argparse
 from pathlib import Path
-from state_fips_mapping import STATE_TO_FIPS
+from csr_network import BACKENDS, build_network, set_node_attributes
+from geocodes import format_geocodes
+from geography_store import open_table
+import instrumentation
+from lodes_partitions import read_flows, select_flows
+from lodes_store import (
+    add_segment_arguments,
+    parse_segment,
+    parse_segments,
+    segment_columns,
+)
+from network_bundle import FORMATS, write_network
+import result_cache
+import threshold_sweep
 
 
-def open_dfs(fnames, **kwargs):
-    """Given a list of filenames, open and concatenate into one data frame."""
-    dfs = []
-    for fname in fnames:
-        _df = pd.read_csv(fname, **kwargs)
-        dfs.append(_df)
-    df = pd.concat(dfs, axis=0, ignore_index=True)
-    return df
+def construct_network(
+    states,
+    minimum_weight,
+    output,
+    backend="networkx",
+    formats=("graphml",),
+    flows=None,
+    thresholds=None,
+    summary_only=False,
+    segments=(),
+    weight_segment=None,
+):
+    """Build and write the network; `flows` is all of read_flows("tract"), if read."""
+    if thresholds is not None:
+        # Build at the lowest threshold, and derive the others from it.
+        minimum_weight = min(thresholds)
+        backend = "csr"
+    if states is not None:
+        states = [x.strip().lower() for x in states.split(",")]
+    with instrumentation.stage("read flows") as record:
+        if flows is None:
+            columns = segment_columns(segments, weight_segment)
+            flow = read_flows("tract", states, columns)
+        else:
+            flow = select_flows(flows, "tract", states)
+        if weight_segment is not None:
+            flow["weight"] = flow[weight_segment]
+        total = flow["weight"].sum()
+        flow = flow.loc[flow["weight"] >= int(minimum_weight), :]
+        record["rows"] = len(flow)
 
-
-def construct_network(states, minimum_weight, output):
-    if states is None:
-        metadata_files = glob.glob(f"data/derived/lodes_tract/*_metadata.csv.gz")
-        pop_files = glob.glob(f"data/raw/population_data/tract/*.tsv")
-        flow_files = glob.glob(f"data/derived/lodes_tract/*_flow.csv.gz")
-        STATES = STATE_TO_FIPS.keys()
-    else:
-        STATES = [x.strip().lower() for x in states.split(",")]
-        metadata_files = []
-        pop_files = []
-        flow_files = []
-        for state in STATES:
-            metadata_files.append(f"data/derived/lodes_tract/{state}_metadata.csv.gz")
-            pop_files.append(f"data/raw/population_data/tract/{state}.tsv")
-            flow_files.append(f"data/derived/lodes_tract/{state}_flow.csv.gz")
-
-    metadata = open_dfs(
-        metadata_files,
-        dtype={"st": "str", "cty": "str", "trct": "str", "zcta": "str"},
-        compression="gzip",
-    )
-    pop = open_dfs(pop_files, sep="\t", dtype={"FIPS": "str"},)
-    flow = open_dfs(
-        flow_files,
-        dtype={"source": "str", "target": "str", "weight": "Int64"},
-        compression="gzip",
-    )
-
-    flow = flow.loc[flow["weight"] >= int(minimum_weight), :]
-    gazetteer = pd.read_csv(
-        "data/raw/2019_Gaz_tracts_national.txt", sep="\t", dtype={"GEOID": str},
-    )
-    gazetteer.columns = [x.strip() for x in gazetteer.columns]
-    gazetteer = gazetteer.loc[:, ["GEOID", "INTPTLONG", "INTPTLAT"]]
-    SFIPS = [STATE_TO_FIPS[s] for s in STATES]
-
-    flow = flow.loc[flow['source'].str[:2].isin(SFIPS), :]
-    flow = flow.loc[flow['target'].str[:2].isin(SFIPS), :]
-    G = nx.from_pandas_edgelist(
-        flow, "source", "target", edge_attr=["weight"], create_using=nx.DiGraph()
-    )
+    nodes = pd.unique(np.concatenate([flow["source"], flow["target"]]))
+    flow["source"] = format_geocodes(flow["source"], "tract")
+    flow["target"] = format_geocodes(flow["target"], "tract")
+    G = build_network(flow, "source", "target", ["weight"] + list(segments), backend)
     del flow
 
-    state_dict = metadata.set_index("trct")["stname"].to_dict()
-    county_dict = metadata.set_index("trct")["ctyname"].to_dict()
-    tract_dict = metadata.set_index("trct")["trctname"].to_dict()
-
-    lat_dict = gazetteer.set_index("GEOID")["INTPTLAT"].to_dict()
-    long_dict = gazetteer.set_index("GEOID")["INTPTLONG"].to_dict()
+    # Every attribute is looked up for the tracts in the network only.
+    fips = format_geocodes(nodes, "tract")
+    names = open_table("tract", "names").lookup(fips)
+    locations = open_table("tract", "gazetteer").lookup(fips)
+    pop = open_table("tract", "population").lookup(fips)
 
-    nx.set_node_attributes(G, state_dict, "state")
-    nx.set_node_attributes(G, county_dict, "county")
-    nx.set_node_attributes(G, tract_dict, "tract")
-    nx.set_node_attributes(G, lat_dict, "latitude")
-    nx.set_node_attributes(G, long_dict, "longitude")
+    set_node_attributes(G, names["state"].to_dict(), "state")
+    set_node_attributes(G, names["county"].to_dict(), "county")
+    set_node_attributes(G, names["tract"].to_dict(), "tract")
+    set_node_attributes(G, locations["latitude"].to_dict(), "latitude")
+    set_node_attributes(G, locations["longitude"].to_dict(), "longitude")
     for p in [
         "Population",
         "<18",
@@ -85,14 +80,21 @@ def construct_network(states, minimum_weight, output):
         "60-64",
         "65+",
     ]:
-        d = pop.set_index("FIPS").loc[:, p].to_dict()
-        nx.set_node_attributes(G, d, p)
+        set_node_attributes(G, pop[p].to_dict(), p)
 
     if output is None:
-        nx.write_graphml(G, "data/derived/tract_commuter_flows.graphml")
+        stem = "data/derived/tract_commuter_flows"
     else:
         Path(f"data/derived/{output}").mkdir(parents=True, exist_ok=True)
-        nx.write_graphml(G, f"data/derived/{output}/tract_commuter_flows.graphml")
+        stem = f"data/derived/{output}/tract_commuter_flows"
+    if thresholds is None:
+        write_network(G, stem, formats)
+    else:
+        threshold_sweep.write_sweep(
+            G, stem, thresholds, formats, summary_only, total
+        )
+
+    return G
 
 
 if __name__ == "__main__":
@@ -123,6 +125,48 @@ if __name__ == "__main__":
         "this is higher, the resulting graph will be sparser.",
         default=0,
     )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="How to hold the network in memory. The csr backend stores edges "
+        "as compact integer arrays, which the largest networks need in order "
+        "to fit in memory.",
+        default="networkx",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        action="store",
+        help=f"A comma-separated list of output formats ({', '.join(FORMATS)}). A "
+        "bundle is a binary columnar directory that network_bundle.load_network "
+        "loads much faster than GraphML. If this argument is absent, write "
+        "GraphML only.",
+        default="graphml",
+    )
+    threshold_sweep.add_arguments(parser)
+    add_segment_arguments(parser)
+    result_cache.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    threshold_sweep.check_arguments(parser, args)
 
-    construct_network(args.states, args.minimum_weight, args.output)
+    instrumentation.start(args)
+    construct = construct_network
+    if args.cache:
+        construct = result_cache.cached("tract", construct_network)
+    construct(
+        args.states,
+        args.minimum_weight,
+        args.output,
+        args.backend,
+        [x.strip() for x in args.formats.split(",")],
+        thresholds=threshold_sweep.parse_thresholds(args.thresholds),
+        summary_only=args.summary_only,
+        segments=parse_segments(args.segments),
+        weight_segment=parse_segment(args.weight_segment),
+    )
+    instrumentation.report(
+        Path("data/derived", args.output or "", "tract_commuter_flows.profile.json")
+    )
@@ -0,0 +1,256 @@
+import networkx as nx
+import numpy as np
+import pandas as pd
+import graphml_writer
+from instrumentation import stage
+
+BACKENDS = ["networkx", "csr"]
+
+
+class CSRNetwork:
+    """A directed network stored as compressed sparse row (CSR) arrays.
+
+    Nodes are numbered in order of first appearance in the edge list, the
+    same order networkx uses, and `nodes` holds their names (FIPS codes). The
+    out-edges of node i are `indices[indptr[i]:indptr[i + 1]]`, and each array
+    in `edge_attrs` (e.g. weight, margin) is aligned with `indices`; these are
+    pandas arrays, so nullable integer weights keep their type. Node
+    attributes are kept as one Series per attribute, indexed by node number
+    and holding only the nodes that have that attribute. For a network built
+    from an edge list, `rows` holds the row where each edge first appears.
+    """
+
+    def __init__(
+        self, nodes, indptr, indices, edge_attrs=None, node_attrs=None, rows=None
+    ):
+        self.nodes = np.asarray(nodes)
+        self.indptr = np.asarray(indptr)
+        self.indices = np.asarray(indices)
+        self.edge_attrs = edge_attrs if edge_attrs is not None else {}
+        self.node_attrs = node_attrs if node_attrs is not None else {}
+        self.rows = rows
+        self._node_index = None
+
+    @classmethod
+    def from_pandas_edgelist(cls, df, source, target, edge_attr=None):
+        edge_attr = edge_attr or []
+        endpoints = np.empty(2 * len(df), dtype=object)
+        endpoints[0::2] = df[source].to_numpy()
+        endpoints[1::2] = df[target].to_numpy()
+        codes, nodes = pd.factorize(endpoints)
+        src = codes[0::2].astype(np.int64)
+        dst = codes[1::2].astype(np.int64)
+        rows = np.arange(len(df))
+        positions = rows
+
+        # As in networkx, a repeated edge keeps the position of its first
+        # occurrence and the attributes of its last.
+        key = src * len(nodes) + dst
+        if pd.Series(key).duplicated().any():
+            _, first, inverse = np.unique(key, return_index=True, return_inverse=True)
+            last = np.zeros(len(first), dtype=np.int64)
+            np.maximum.at(last, inverse, rows)
+            keep = np.sort(first)
+            rows = last[inverse[keep]]
+            positions = keep
+            src = src[keep]
+            dst = dst[keep]
+
+        order = np.argsort(src, kind="stable")
+        counts = np.bincount(src, minlength=len(nodes))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        edge_attrs = {attr: df[attr].array.take(rows[order]) for attr in edge_attr}
+        return cls(
+            np.asarray(nodes), indptr, dst[order], edge_attrs, rows=positions[order]
+        )
+
+    @classmethod
+    def from_networkx(cls, G):
+        nodes = list(G)
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = list(G.edges(data=True))
+        sources = np.array([index[u] for u, _, _ in edges], dtype=np.int64)
+        targets = np.array([index[v] for _, v, _ in edges], dtype=np.int64)
+        counts = np.bincount(sources, minlength=len(nodes))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+
+        edge_attrs = {}
+        for _, _, data in edges:
+            for attr in data:
+                edge_attrs.setdefault(attr, None)
+        for attr in edge_attrs:
+            edge_attrs[attr] = pd.Series([data.get(attr) for _, _, data in edges]).array
+
+        network = cls(np.array(nodes, dtype=object), indptr, targets, edge_attrs)
+        attrs = {}
+        for node, data in G.nodes(data=True):
+            for attr, value in data.items():
+                attrs.setdefault(attr, {})[node] = value
+        for attr, values in attrs.items():
+            network.set_node_attributes(values, attr)
+        return network
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.indices)
+
+    def node_index(self):
+        if self._node_index is None:
+            self._node_index = pd.Index(self.nodes)
+        return self._node_index
+
+    def sources(self):
+        """The node number of the source of every edge, aligned with `indices`."""
+        return np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+
+    def subnetwork(self, edges):
+        """The network of the edges at the sorted positions `edges` and their ends.
+
+        Nodes and edges are numbered and ordered as from_pandas_edgelist would
+        number them given just these edges' rows, so the result is the network
+        the filtered edge list would build, with the same node attributes.
+        """
+        rows = np.asarray(edges) if self.rows is None else self.rows[edges]
+        src = self.sources()[edges]
+        dst = self.indices[edges]
+
+        # Number the nodes in order of first appearance, sources before targets.
+        endpoints = np.concatenate([src, dst])
+        positions = np.concatenate([2 * rows, 2 * rows + 1])
+        endpoints = endpoints[np.argsort(positions, kind="stable")]
+        _, first = np.unique(endpoints, return_index=True)
+        kept = endpoints[np.sort(first)]
+        number = np.full(len(self.nodes), -1, dtype=np.int64)
+        number[kept] = np.arange(len(kept))
+
+        src = number[src]
+        order = np.lexsort((rows, src))
+        counts = np.bincount(src, minlength=len(kept))
+        indptr = np.concatenate([[0], np.cumsum(counts)])
+        edge_attrs = {
+            attr: values.take(edges[order]) for attr, values in self.edge_attrs.items()
+        }
+        node_attrs = {}
+        for name, attr in self.node_attrs.items():
+            attr = attr[number[attr.index] >= 0]
+            node_attrs[name] = pd.Series(
+                attr.array, index=number[attr.index]
+            ).sort_index()
+        return CSRNetwork(
+            self.nodes[kept],
+            indptr,
+            number[dst[order]],
+            edge_attrs,
+            node_attrs,
+            rows[order],
+        )
+
+    def set_node_attributes(self, values, name):
+        """Set attribute `name` from a dict or Series keyed by node name.
+
+        Like `nx.set_node_attributes`, keys that aren't nodes are ignored.
+        """
+        values = pd.Series(values, dtype=object if len(values) == 0 else None)
+        positions = self.node_index().get_indexer(values.index)
+        present = positions >= 0
+        attr = pd.Series(values.to_numpy()[present], index=positions[present])
+        self.node_attrs[name] = attr.sort_index()
+
+    def set_node_table(self, table):
+        """Set one attribute per column of a data frame indexed by node name."""
+        positions = self.node_index().get_indexer(table.index)
+        present = positions >= 0
+        for name in table.columns:
+            attr = pd.Series(table[name].array[present], index=positions[present])
+            self.node_attrs[name] = attr.sort_index()
+
+    def edge_table(self):
+        """Return the edges as a data frame of source and target names."""
+        df = pd.DataFrame(
+            {
+                "source": self.nodes[self.sources()],
+                "target": self.nodes[self.indices],
+            }
+        )
+        for attr, values in self.edge_attrs.items():
+            df[attr] = values
+        return df
+
+    def write_graphml(self, path):
+        """Stream the network to GraphML without converting it to networkx."""
+        graphml_writer.write_graphml(
+            path,
+            self.nodes,
+            self.sources(),
+            self.indices,
+            self.node_attrs,
+            self.edge_attrs,
+        )
+
+    def to_networkx(self):
+        G = nx.DiGraph()
+        G.add_nodes_from(self.nodes.tolist())
+        names = self.nodes.tolist()
+        # Iterating a Series gives the same scalar types as from_pandas_edgelist.
+        attrs = {
+            attr: list(pd.Series(values)) for attr, values in self.edge_attrs.items()
+        }
+        sources = self.sources().tolist()
+        targets = self.indices.tolist()
+        G.add_edges_from(
+            (
+                names[sources[i]],
+                names[targets[i]],
+                {attr: values[i] for attr, values in attrs.items()},
+            )
+            for i in range(len(targets))
+        )
+        for name, attr in self.node_attrs.items():
+            nx.set_node_attributes(
+                G, dict(zip(self.nodes[attr.index].tolist(), attr.tolist())), name
+            )
+        return G
+
+
+def build_network(df, source, target, edge_attr, backend="networkx"):
+    """Build a directed network from an edge list with the chosen backend."""
+    with stage("build network", rows=len(df)):
+        if backend == "csr":
+            return CSRNetwork.from_pandas_edgelist(df, source, target, edge_attr)
+        return nx.from_pandas_edgelist(
+            df, source, target, edge_attr=edge_attr, create_using=nx.DiGraph()
+        )
+
+
+def set_node_attributes(G, values, name):
+    with stage("set node attributes", rows=len(values)):
+        if isinstance(G, CSRNetwork):
+            G.set_node_attributes(values, name)
+        else:
+            nx.set_node_attributes(G, values, name)
+
+
+def set_node_table(G, table):
+    """Set the attributes in the columns of `table`, indexed by node name, at once.
+
+    The result is the same as calling set_node_attributes for each column.
+    """
+    with stage("set node attributes", rows=len(table)):
+        if isinstance(G, CSRNetwork):
+            G.set_node_table(table)
+        else:
+            nx.set_node_attributes(G, table.to_dict("index"))
+
+
+def write_graphml(G, path):
+    """Stream either backend's network to GraphML, without an XML tree in memory."""
+    if isinstance(G, CSRNetwork):
+        G.write_graphml(path)
+        return
+    try:
+        graphml_writer.write_networkx(path, G)
+    except ValueError:
+        # Edges with differing attributes, which only networkx can write.
+        nx.write_graphml(G, path)
@@ -0,0 +1,314 @@
+import argparse
+import glob
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from columnar import read_arrays, read_table, write_table
+from instrumentation import stage
+
+# A store of geography attributes shared by the network scripts: gazetteer
+# internal points, ACS population tables (summed over counties for states),
+# and names and block coordinates from the LODES crosswalks. Each is a
+# columnar table under data/derived/geography, sorted by an integer `geoid`
+# column (the FIPS code as a number), so attributes are looked up with a
+# binary search over a memory-mapped array rather than by parsing and joining
+# the text files.
+#
+# The tables are built from their source files the first time they are
+# needed, and rebuilt when a source file is added, removed or modified.
+#
+#   python geography_store.py            # build or refresh every table
+
+STORE_DIR = "data/derived/geography"
+STORE_VERSION = 3
+
+BANDS = [
+    "Population",
+    "<18",
+    "18-24",
+    "25-29",
+    "30-34",
+    "35-39",
+    "40-44",
+    "45-49",
+    "50-54",
+    "55-59",
+    "60-64",
+    "65+",
+]
+
+
+def gazetteer_file(kind):
+    return f"data/raw/2019_Gaz_{kind}_national.txt"
+
+
+def population_files(level):
+    return sorted(glob.glob(f"data/raw/population_data/{level}/*.tsv"))
+
+
+def xwalk_files():
+    return sorted(glob.glob("data/raw/LODES7/*/*_xwalk.csv.gz"))
+
+
+def to_geoids(fips):
+    """FIPS codes (strings or integers) as integers; -1 where not numeric."""
+    geoids = pd.to_numeric(pd.Series(np.asarray(fips)), errors="coerce")
+    return geoids.fillna(-1).to_numpy(dtype=np.int64)
+
+
+def keyed(df, fips):
+    """Add the geoid key for `fips` and sort by it, keeping the last duplicate."""
+    df = df.assign(geoid=to_geoids(fips))
+    df = df.loc[~df["geoid"].duplicated(keep="last"), :]
+    return df.sort_values("geoid", kind="mergesort").reset_index(drop=True)
+
+
+def read_gazetteer(kind):
+    gazetteer = pd.read_csv(gazetteer_file(kind), sep="\t", dtype={"GEOID": str})
+    gazetteer.columns = [x.strip() for x in gazetteer.columns]
+    return gazetteer.loc[:, ["GEOID", "INTPTLONG", "INTPTLAT"]].rename(
+        {"INTPTLONG": "longitude", "INTPTLAT": "latitude"}, axis=1
+    )
+
+
+def build_gazetteer(level):
+    if level == "town":
+        # Town flows mix MCD and county-level nodes, the latter padded out to
+        # the 10-digit MCD code with zeros.
+        county = read_gazetteer("counties")
+        county["GEOID"] = county["GEOID"] + "00000"
+        gazetteer = pd.concat([county, read_gazetteer("cousubs")])
+    else:
+        gazetteer = read_gazetteer({"county": "counties", "tract": "tracts"}[level])
+    return keyed(gazetteer.loc[:, ["longitude", "latitude"]], gazetteer["GEOID"])
+
+
+def build_population(level):
+    # All the columns of the population tables, as read by pandas, so that
+    # the county and town scripts can still write them out with their flows.
+    pop = pd.concat(
+        [
+            pd.read_csv(fname, sep="\t", dtype={"FIPS": "str"})
+            for fname in population_files(level)
+        ],
+        axis=0,
+        ignore_index=True,
+    )
+    return keyed(pop, pop["FIPS"])
+
+
+def build_county():
+    population = build_population("county")
+    state = population.groupby(population["FIPS"].str[:2]).agg(
+        {band: "sum" for band in BANDS}
+    )
+    return {
+        ("county", "gazetteer"): build_gazetteer("county"),
+        ("county", "population"): population,
+        ("state", "population"): keyed(state.reset_index(drop=True), state.index),
+    }
+
+
+def build_crosswalk():
+    names = []
+    coordinates = []
+    for fname in xwalk_files():
+        xwalk = pd.read_csv(
+            fname,
+            sep=",",
+            usecols=[
+                "tabblk2010",
+                "trct",
+                "stname",
+                "ctyname",
+                "trctname",
+                "blklatdd",
+                "blklondd",
+            ],
+            compression="gzip",
+            encoding="latin-1",
+            dtype={
+                "trct": "str",
+                "stname": "category",
+                "ctyname": "category",
+                "trctname": "category",
+                "blklatdd": "str",
+                "blklondd": "str",
+            },
+        )
+        names.append(
+            xwalk.groupby("trct")
+            .agg({"stname": "first", "ctyname": "first", "trctname": "first"})
+            .reset_index()
+        )
+        coordinates.append(
+            xwalk.loc[:, ["tabblk2010", "blklatdd", "blklondd"]].rename(
+                {"blklatdd": "latitude", "blklondd": "longitude"}, axis=1
+            )
+        )
+        del xwalk
+
+    # Names repeat across tracts and, in the block network, across blocks, so
+    # they are kept as categoricals.
+    names = (
+        pd.concat(names, axis=0, ignore_index=True)
+        .rename({"stname": "state", "ctyname": "county", "trctname": "tract"}, axis=1)
+        .astype({"state": "category", "county": "category", "tract": "category"})
+    )
+    counties = names.groupby(names["trct"].str[:5]).agg(
+        {"state": "first", "county": "first"}
+    )
+    states = names.groupby(names["trct"].str[:2]).agg({"state": "first"})
+    coordinates = pd.concat(coordinates, axis=0, ignore_index=True)
+    return {
+        ("state", "names"): keyed(states.reset_index(drop=True), states.index),
+        ("county", "names"): keyed(counties.reset_index(drop=True), counties.index),
+        ("tract", "names"): keyed(names.drop(columns="trct"), names["trct"]),
+        ("block", "coordinates"): keyed(
+            coordinates.drop(columns="tabblk2010"), coordinates["tabblk2010"]
+        ),
+    }
+
+
+# Groups of tables built together from the same source files.
+GROUPS = {
+    "county": (
+        lambda: [gazetteer_file("counties")] + population_files("county"),
+        build_county,
+    ),
+    "town": (
+        lambda: [gazetteer_file("counties"), gazetteer_file("cousubs")]
+        + population_files("town"),
+        lambda: {
+            ("town", "gazetteer"): build_gazetteer("town"),
+            ("town", "population"): build_population("town"),
+        },
+    ),
+    "tract": (
+        lambda: [gazetteer_file("tracts")] + population_files("tract"),
+        lambda: {
+            ("tract", "gazetteer"): build_gazetteer("tract"),
+            ("tract", "population"): build_population("tract"),
+        },
+    ),
+    "crosswalk": (xwalk_files, build_crosswalk),
+}
+TABLES = {
+    ("state", "names"): "crosswalk",
+    ("state", "population"): "county",
+    ("county", "names"): "crosswalk",
+    ("county", "gazetteer"): "county",
+    ("county", "population"): "county",
+    ("town", "gazetteer"): "town",
+    ("town", "population"): "town",
+    ("tract", "gazetteer"): "tract",
+    ("tract", "population"): "tract",
+    ("tract", "names"): "crosswalk",
+    ("block", "coordinates"): "crosswalk",
+}
+
+
+def stamps(fnames):
+    stamps = {}
+    for fname in fnames:
+        stat = os.stat(fname)
+        stamps[fname] = [stat.st_size, stat.st_mtime_ns]
+    return {"version": STORE_VERSION, "inputs": stamps}
+
+
+def refresh(group, force=False):
+    """Rebuild the tables of `group` if any of their source files changed.
+
+    Returns whether the tables were rebuilt.
+    """
+    inputs, build = GROUPS[group]
+    current = stamps(inputs())
+    path = Path(STORE_DIR) / f"{group}.json"
+    if not force and path.is_file():
+        with open(path) as f:
+            if json.load(f) == current:
+                return False
+
+    with stage(f"build {group} geography"):
+        for (level, name), df in build().items():
+            write_table(df, Path(STORE_DIR) / level / name, meta={"group": group})
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(current, f)
+    tmp.replace(path)
+    return True
+
+
+class GeographyTable:
+    """One table of the store, with lookups by FIPS code."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.geoids = read_arrays(self.path, columns=["geoid"])["geoid"]
+
+    def find(self, fips):
+        """The row of each FIPS code, and whether it is in the table at all."""
+        geoids = to_geoids(fips)
+        rows = np.searchsorted(self.geoids, geoids)
+        found = rows < len(self.geoids)
+        found[found] = self.geoids[rows[found]] == geoids[found]
+        return np.where(found, rows, 0), found
+
+    def take(self, fips, columns=None):
+        """The rows of `fips` in order, as a left merge on FIPS would give them.
+
+        Rows for codes missing from the table are all missing values, which
+        turns integer columns into floats, just as a merge does.
+        """
+        with stage("look up attributes", rows=len(fips)):
+            rows, found = self.find(fips)
+            df = read_table(self.path, columns=columns, rows=rows[found])
+            df.index = np.flatnonzero(found)
+            return df.drop(columns="geoid", errors="ignore").reindex(
+                pd.RangeIndex(len(found))
+            )
+
+    def lookup(self, fips, columns=None):
+        """The rows of the codes in `fips` found in the table, indexed by them."""
+        fips = np.asarray(fips)
+        with stage("look up attributes", rows=len(fips)):
+            rows, found = self.find(fips)
+            df = read_table(self.path, columns=columns, rows=rows[found]).drop(
+                columns="geoid", errors="ignore"
+            )
+            df.index = fips[found]
+            return df
+
+
+def open_table(level, name):
+    """Open a table of the store, building or refreshing it first if needed."""
+    refresh(TABLES[(level, name)])
+    return GeographyTable(Path(STORE_DIR) / level / name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the geography attribute store used by the network "
+        "scripts."
+    )
+    parser.add_argument(
+        "-g",
+        "--groups",
+        action="store",
+        help=f"A comma-separated list of table groups to build "
+        f"({', '.join(GROUPS)}). If this argument is absent, build all of them.",
+        default=None,
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Rebuild the tables even if their source files are unchanged.",
+    )
+    args = parser.parse_args()
+    groups = GROUPS if args.groups is None else args.groups.split(",")
+    for group in groups:
+        built = refresh(group.strip(), args.force)
+        print(f"{group}: {'built' if built else 'up to date'}")
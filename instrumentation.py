@@ -0,0 +1,200 @@
+import cProfile
+import io
+import json
+import pstats
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# Per-stage timing and memory figures for the build scripts. Code marks its
+# stages with
+#
+#   with stage("read flows") as record:
+#       df = ...
+#       record["rows"] = len(df)
+#
+# and, once enabled (every script's --profile flag), each pass through a stage
+# records its wall time, the rows it handled and the peak RSS while it ran.
+# `report` prints a table summed by stage name and can write the records as
+# JSON; with --profile-stage, that stage also runs under cProfile. Stages may
+# nest. Disabled, stages record nothing and cost next to nothing.
+#
+# On Linux the peak is reset at the start of each stage, so each stage gets
+# its own peak; elsewhere it is the peak of the process so far. The peak is
+# process-wide, so stages running concurrently in threads share it.
+
+ENABLED = False
+PROFILE_STAGE = None
+RECORDS = []
+
+_profiler = None
+_started = None
+_local = threading.local()
+
+
+def enable(profile_stage=None):
+    """Start recording stages, and profile the stage `profile_stage` if given."""
+    global ENABLED, PROFILE_STAGE, _profiler, _started
+    ENABLED = True
+    _started = time.perf_counter()
+    PROFILE_STAGE = profile_stage
+    _profiler = cProfile.Profile() if profile_stage is not None else None
+
+
+def peak_rss():
+    """The peak resident set size in MB, since the last reset on Linux."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return max_rss()
+
+
+def max_rss():
+    """The peak resident set size in MB over the life of the process."""
+    # ru_maxrss is in KB on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+@contextmanager
+def stage(name, rows=None):
+    """Record a pass through the stage `name`; yields its record to fill in."""
+    record = {"stage": name, "rows": rows}
+    if not ENABLED:
+        yield record
+        return
+
+    stack = _local.__dict__.setdefault("stack", [])
+    # Fold the peak so far into the enclosing stages before resetting it.
+    peak = peak_rss()
+    for outer in stack:
+        outer["peak_mb"] = max(outer["peak_mb"], peak)
+    reset_peak_rss()
+    record["peak_mb"] = 0.0
+    stack.append(record)
+
+    profiling = _profiler is not None and name == PROFILE_STAGE
+    if profiling:
+        _profiler.enable()
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if profiling:
+            _profiler.disable()
+        stack.pop()
+        peak = peak_rss()
+        for active in stack + [record]:
+            active["peak_mb"] = max(active["peak_mb"], peak)
+        RECORDS.append(record)
+
+
+def take():
+    """Remove and return the records so far, e.g. to send them to a parent."""
+    records = RECORDS[:]
+    del RECORDS[:]
+    return records
+
+
+def summary(records=None):
+    """The records summed by stage name, in order of first appearance."""
+    stages = {}
+    for record in RECORDS if records is None else records:
+        total = stages.setdefault(
+            record["stage"],
+            {"stage": record["stage"], "calls": 0, "seconds": 0.0, "rows": None},
+        )
+        total["calls"] += 1
+        total["seconds"] += record["seconds"]
+        total["peak_mb"] = max(total.get("peak_mb", 0.0), record["peak_mb"])
+        if record["rows"] is not None:
+            total["rows"] = (total["rows"] or 0) + record["rows"]
+    for total in stages.values():
+        if total["rows"] is not None and total["seconds"] > 0:
+            total["rows_per_second"] = total["rows"] / total["seconds"]
+    return list(stages.values())
+
+
+def format_summary(stages):
+    width = max([len("stage")] + [len(s["stage"]) for s in stages])
+    lines = [
+        f"{'stage':<{width}} {'calls':>6} {'seconds':>9} {'rows':>12} "
+        f"{'rows/s':>12} {'peak MB':>9}"
+    ]
+    for s in stages:
+        rows = "" if s["rows"] is None else f"{s['rows']:,}"
+        rate = s.get("rows_per_second")
+        rate = "" if rate is None else f"{rate:,.0f}"
+        lines.append(
+            f"{s['stage']:<{width}} {s['calls']:>6} {s['seconds']:>9.3f} "
+            f"{rows:>12} {rate:>12} {s['peak_mb']:>9.1f}"
+        )
+    return "\n".join(lines)
+
+
+def report(path=None):
+    """Print the summary, and write it with every record to `path` as JSON.
+
+    If a stage was profiled, its statistics go to `path` with a .prof suffix
+    and the top functions are printed too.
+    """
+    if not ENABLED:
+        return
+    stages = summary()
+    total = time.perf_counter() - _started
+    print(format_summary(stages))
+    print(f"total {total:.3f}s, peak RSS of the process {max_rss():.1f} MB")
+
+    if _profiler is not None:
+        stream = io.StringIO()
+        stats = pstats.Stats(_profiler, stream=stream)
+        stats.sort_stats("cumulative").print_stats(20)
+        print(f"\nProfile of {PROFILE_STAGE}:\n{stream.getvalue()}")
+
+    if path is not None:
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(
+                {"seconds": total, "stages": stages, "records": RECORDS}, f, indent=2
+            )
+        if _profiler is not None:
+            _profiler.dump_stats(path.with_suffix(".prof"))
+
+
+def add_arguments(parser):
+    """Add the --profile and --profile-stage options to a script's parser."""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time, rows and peak memory of each stage, and write "
+        "them as JSON next to the output.",
+    )
+    parser.add_argument(
+        "--profile-stage",
+        action="store",
+        help="Also run the named stage under cProfile (implies --profile), "
+        "printing its top functions and writing the statistics to a .prof "
+        "file next to the output.",
+        default=None,
+    )
+
+
+def start(args):
+    """Enable the instrumentation if the parsed `args` ask for it."""
+    if args.profile or args.profile_stage is not None:
+        enable(args.profile_stage)
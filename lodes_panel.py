@@ -0,0 +1,527 @@
+import argparse
+import json
+import shutil
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from columnar import read_arrays, write_table
+from csr_network import BACKENDS, build_network, set_node_table
+from geocodes import format_geocodes
+from geography_store import open_table
+import instrumentation
+from lodes_partitions import partition_dir, read_flows
+from lodes_store import SEGMENTS, parse_segment, segment_columns
+from network_bundle import FORMATS, write_network
+from state_fips_mapping import STATE_TO_FIPS
+
+# A panel of LODES networks over many years, for longitudinal studies. Each
+# year is read from its partitions (aggregate_lodes_tract_level.py -y <year>),
+# and every node and edge gets one id for the whole panel, in order of first
+# appearance (new ones sorted by geocode within their year), so node i is the
+# same tract in every year. Rather than a network per year, the panel stores
+# each year as its changes from the year before: the edges whose weight
+# changed, appeared or disappeared (weight 0). An edge that keeps its weight is
+# stored once, however many years it lasts.
+#
+#   data/derived/<output>/<name>_panel/panel.json     the options and years
+#   data/derived/<output>/<name>_panel/nodes/         the geocode of each node
+#   data/derived/<output>/<name>_panel/edges/         the nodes of each edge
+#   data/derived/<output>/<name>_panel/years/<year>/  each edge that changed,
+#                                                     with its new weight
+#
+# with <name> tract, lodes_county or lodes_state; blocks aren't partitioned, so
+# they have no panel. The manifest records the size and mtime of the partition
+# files each year was read from. Asking again for the years of a panel with the
+# same options, or for some of them, keeps it; asking for more years after its
+# last one extends it, as ids only grow. Either way, the years from the first
+# one whose partitions changed since it was built are built again. Any other
+# years build a new panel.
+#
+# Panel.flows and Panel.diff rebuild a year's flows, or the changes between
+# two years, and the script writes them as networks, with the names of the
+# nodes as attributes (their populations are of one year only).
+#
+#   python lodes_panel.py -l tract -y 2010-2016 -o panel
+#   python lodes_panel.py -l tract -y 2010-2016 -o panel -n 2016 -d all
+
+LEVELS = ["tract", "county", "state"]
+PANEL_VERSION = 2
+MANIFEST = "panel.json"
+
+
+def network_name(level):
+    return "tract" if level == "tract" else f"lodes_{level}"
+
+
+def panel_dir(level, output=None):
+    return Path("data/derived", output or "", f"{network_name(level)}_panel")
+
+
+def parse_years(years):
+    """Sorted distinct years from a comma-separated list of years and ranges."""
+    parsed = set()
+    for x in years.split(","):
+        first, _, last = x.strip().partition("-")
+        parsed.update(range(int(first), int(last or first) + 1))
+    return sorted(parsed)
+
+
+def parse_diffs(diffs, years):
+    """(before, after) year pairs from a comma-separated list of before:after.
+
+    "all" stands for each of `years` after the first and the year before it.
+    """
+    if diffs is None:
+        return []
+    pairs = []
+    for x in diffs.split(","):
+        if x.strip().lower() == "all":
+            pairs += zip(years[:-1], years[1:])
+        else:
+            before, after = x.split(":")
+            pairs.append((int(before), int(after)))
+    return list(dict.fromkeys(pairs))
+
+
+def extend(index, values):
+    """The ids of `values` in `index`, and `index` with the new ones appended.
+
+    `index` holds the values of the ids so far in id order. Values not in it
+    get the next ids, in sorted order.
+    """
+    order = np.argsort(index, kind="stable")
+    positions = np.searchsorted(index, values, sorter=order)
+    found = positions < len(index)
+    found[found] = index[order[positions[found]]] == values[found]
+    new = np.unique(values[~found])
+    ids = np.empty(len(values), dtype=np.int64)
+    ids[found] = order[positions[found]]
+    ids[~found] = len(index) + np.searchsorted(new, values[~found])
+    return ids, np.concatenate([index, new])
+
+
+def read_year(level, year, states, minimum_weight, weight_segment=None):
+    """The flows of `year` that pass the minimum weight, as plain arrays."""
+    columns = segment_columns((), weight_segment)
+    flow = read_flows(level, states, columns, year)
+    weight = flow["weight" if weight_segment is None else weight_segment]
+    weight = weight.to_numpy(dtype=np.int64)
+    keep = (weight >= minimum_weight) & (weight > 0)
+    return (
+        flow["source"].to_numpy()[keep],
+        flow["target"].to_numpy()[keep],
+        weight[keep],
+    )
+
+
+def work_states(level, year, states=None):
+    """The states among `states` (all if None) with partitions in `year`."""
+    directory = partition_dir(level, year)
+    if states is None:
+        states = sorted(STATE_TO_FIPS)
+    return [
+        state
+        for state in states
+        if (directory / f"{STATE_TO_FIPS[state]}.json").is_file()
+    ]
+
+
+def check_states(level, years, states=None):
+    """The work states of each year, checked to be the same in every year.
+
+    A state missing from some years would otherwise show up as all of its
+    flows disappearing and coming back.
+    """
+    works = {year: work_states(level, year, states) for year in years}
+    expected = works[years[0]] if states is None else states
+    problems = []
+    for year in years:
+        missing = sorted(set(expected) - set(works[year]))
+        extra = sorted(set(works[year]) - set(expected))
+        if missing:
+            problems.append(
+                f"{year} has no {level} partitions for {','.join(missing)} "
+                f"(aggregate_lodes_tract_level.py -y {year} -s {','.join(missing)})"
+            )
+        if extra:
+            problems.append(
+                f"{year} has {level} partitions for {','.join(extra)}, "
+                f"which {years[0]} lacks"
+            )
+    if problems:
+        raise ValueError(
+            "The years of a panel need the same states:\n" + "\n".join(problems)
+        )
+    return works
+
+
+def input_stamps(level, year, states):
+    """The size and mtime of the partition files of `states` in `year`."""
+    directory = partition_dir(level, year)
+    stamps = {}
+    for work in sorted(STATE_TO_FIPS[state] for state in states):
+        for fname in [directory / f"{work}.json"] + sorted(
+            (directory / work).rglob("*")
+        ):
+            if fname.is_file():
+                stat = fname.stat()
+                stamps[str(fname)] = [stat.st_size, stat.st_mtime_ns]
+    return stamps
+
+
+def options(level, states, minimum_weight, weight_segment):
+    if states is not None:
+        states = sorted({x.strip().lower() for x in states.split(",")})
+    return {
+        "version": PANEL_VERSION,
+        "level": level,
+        "states": states,
+        "minimum_weight": int(minimum_weight),
+        "weight_segment": weight_segment,
+    }
+
+
+def write_manifest(path, manifest):
+    tmp = path / (MANIFEST + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    tmp.replace(path / MANIFEST)
+
+
+def build_panel(
+    level, years, states=None, minimum_weight=0, output=None, weight_segment=None
+):
+    """Build, update or extend the panel of `level` over `years`.
+
+    An existing panel with the same options is kept if it has every one of
+    `years`, and extended if `years` starts with all of its years; in both
+    cases only the years from the first one whose partitions changed are
+    built again. Otherwise the panel is built anew, for `years` only.
+    Returns the manifest, whose years may be more than `years`.
+    """
+    if level not in LEVELS:
+        raise ValueError(
+            f"There are no {level} panels: a panel reads its years from the "
+            f"partitions of aggregate_lodes_tract_level.py, one of {LEVELS}."
+        )
+    path = panel_dir(level, output)
+    manifest = options(level, states, minimum_weight, weight_segment)
+    built = []
+    if (path / MANIFEST).is_file():
+        with open(path / MANIFEST) as f:
+            saved = json.load(f)
+        built = saved.pop("years")
+        if saved != manifest:
+            print(f"Rebuilding the panel in {path}, whose options differ")
+            built = []
+    built_years = [entry["year"] for entry in built]
+    if set(years) <= set(built_years):
+        years = built_years
+    elif built and built_years != years[: len(built)]:
+        print(f"Rebuilding the panel in {path} for {years}, as it has {built_years}")
+        built = []
+
+    # Check every year before anything is built or removed.
+    works = check_states(level, years, manifest["states"])
+    stamps = {year: input_stamps(level, year, works[year]) for year in years}
+    kept = 0
+    while kept < len(built) and built[kept].get("inputs") == stamps[years[kept]]:
+        kept += 1
+    summary = built[:kept]
+    manifest["years"] = summary
+    if kept == len(years):
+        print(f"The panel in {path} is up to date")
+        return manifest
+
+    if kept == 0:
+        if built:
+            print(f"Rebuilding the panel in {path}, as {years[0]} changed")
+        shutil.rmtree(path, ignore_errors=True)
+        nodes = np.empty(0, dtype=np.int64)
+        keys = np.empty(0, dtype=np.int64)
+        weights = np.empty(0, dtype=np.int64)
+    else:
+        # Drop the ids first given in the years built again.
+        panel = Panel(path)
+        nodes = np.array(panel.nodes[: summary[-1]["node_ids"]], dtype=np.int64)
+        keys = (panel.sources.astype(np.int64) << 32) | panel.targets
+        keys = keys[: summary[-1]["edge_ids"]]
+        weights = panel.weights(summary[-1]["year"])[: len(keys)]
+        if kept < len(built):
+            print(f"Updating the panel in {path} from {years[kept]}, as it changed")
+        else:
+            print(f"Extending the panel in {path} with {years[kept:]}")
+    path.mkdir(parents=True, exist_ok=True)
+
+    for year in years[kept:]:
+        with instrumentation.stage("read flows") as record:
+            source, target, weight = read_year(
+                level, year, manifest["states"], int(minimum_weight), weight_segment
+            )
+            record["rows"] = len(weight)
+        with instrumentation.stage("number edges", rows=len(weight)):
+            ids, nodes = extend(nodes, np.concatenate([source, target]))
+            # A node id fits in 32 bits, so an edge's two ends fit in 64.
+            edge_keys = (ids[: len(source)] << 32) | ids[len(source) :]
+            edges, keys = extend(keys, edge_keys)
+        with instrumentation.stage("write changes", rows=len(weight)):
+            previous = np.zeros(len(keys), dtype=np.int64)
+            previous[: len(weights)] = weights
+            weights = np.zeros(len(keys), dtype=np.int64)
+            weights[edges] = weight
+            changed = np.flatnonzero(weights != previous)
+            write_table(
+                pd.DataFrame(
+                    {
+                        "edge": changed.astype(np.int32),
+                        "weight": weights[changed].astype(np.int32),
+                    }
+                ),
+                path / "years" / str(year),
+            )
+        summary.append(
+            {
+                "year": year,
+                "nodes": len(np.unique(ids)),
+                "edges": len(weight),
+                "weight": int(weight.sum()),
+                "changes": len(changed),
+                "node_ids": len(nodes),
+                "edge_ids": len(keys),
+                "inputs": stamps[year],
+            }
+        )
+
+    # The ids of the kept years don't change, so their tables stay valid while
+    # these are rewritten.
+    write_table(pd.DataFrame({"geocode": nodes}), path / "nodes")
+    write_table(
+        pd.DataFrame(
+            {
+                "source": (keys >> 32).astype(np.int32),
+                "target": (keys & 0xFFFFFFFF).astype(np.int32),
+            }
+        ),
+        path / "edges",
+    )
+    write_manifest(path, manifest)
+    return manifest
+
+
+class Panel:
+    """A panel written by build_panel, with the flows of any year rebuilt from it."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / MANIFEST) as f:
+            self.manifest = json.load(f)
+        self.level = self.manifest["level"]
+        self.years = [entry["year"] for entry in self.manifest["years"]]
+        self.nodes = read_arrays(self.path / "nodes")["geocode"]
+        edges = read_arrays(self.path / "edges")
+        self.sources = edges["source"]
+        self.targets = edges["target"]
+
+    def weights(self, year):
+        """The weight of every edge of the panel in `year`, 0 where it is absent."""
+        if year not in self.years:
+            raise ValueError(f"{year} is not in the panel; it has {self.years}.")
+        weights = np.zeros(len(self.sources), dtype=np.int64)
+        for y in self.years[: self.years.index(year) + 1]:
+            changes = read_arrays(self.path / "years" / str(y))
+            weights[changes["edge"]] = changes["weight"]
+        return weights
+
+    def frame(self, edges, **columns):
+        return pd.DataFrame(
+            {
+                "source": self.nodes[self.sources[edges]],
+                "target": self.nodes[self.targets[edges]],
+                **columns,
+            }
+        )
+
+    def flows(self, year):
+        """The flows of `year`, with their source and target geocodes."""
+        weights = self.weights(year)
+        edges = np.flatnonzero(weights)
+        return self.frame(edges, weight=weights[edges])
+
+    def diff(self, before, after):
+        """The flows whose weight changed from `before` to `after`.
+
+        The weight is the change, next to the weight in each year (0 where
+        the flow is absent).
+        """
+        old = self.weights(before)
+        new = self.weights(after)
+        edges = np.flatnonzero(old != new)
+        return self.frame(
+            edges,
+            weight=new[edges] - old[edges],
+            weight_before=old[edges],
+            weight_after=new[edges],
+        )
+
+
+def build_panel_network(level, df, backend="networkx"):
+    """A network of the flows in `df`, with the names of its nodes."""
+    nodes = pd.unique(np.concatenate([df["source"], df["target"]]))
+    df = df.assign(
+        source=format_geocodes(df["source"], level),
+        target=format_geocodes(df["target"], level),
+    )
+    attrs = [column for column in df.columns if column not in ["source", "target"]]
+    G = build_network(df, "source", "target", attrs, backend)
+    set_node_table(G, open_table(level, "names").lookup(format_geocodes(nodes, level)))
+    return G
+
+
+def main(
+    level,
+    years,
+    states=None,
+    minimum_weight=0,
+    output=None,
+    weight_segment=None,
+    networks=(),
+    diffs=(),
+    backend="networkx",
+    formats=("graphml",),
+):
+    manifest = build_panel(level, years, states, minimum_weight, output, weight_segment)
+    summary = pd.DataFrame(manifest["years"])
+    summary = summary.loc[:, ["year", "nodes", "edges", "weight", "changes"]]
+    print(summary.to_string(index=False))
+    print(
+        f"Stored {summary['changes'].sum():,} changes for "
+        f"{summary['edges'].sum():,} flows over {len(summary)} years"
+    )
+
+    panel = Panel(panel_dir(level, output))
+    stem = panel_dir(level, output).with_name(f"{network_name(level)}_commuter_flows")
+    for year in networks:
+        with instrumentation.stage("write network"):
+            G = build_panel_network(level, panel.flows(year), backend)
+            write_network(G, f"{stem}_{year}", formats)
+    for before, after in diffs:
+        with instrumentation.stage("write diff"):
+            G = build_panel_network(level, panel.diff(before, after), backend)
+            write_network(G, f"{stem}_{before}_{after}", formats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build a multi-year panel of LODES networks with one node "
+        "index, stored as the changes from year to year."
+    )
+    parser.add_argument(
+        "-l",
+        "--level",
+        action="store",
+        choices=LEVELS,
+        help="The level of the networks. There are no block panels, as the "
+        "years are read from the tract, county and state partitions of "
+        "aggregate_lodes_tract_level.py, and blocks have none.",
+        default="tract",
+    )
+    parser.add_argument(
+        "-y",
+        "--years",
+        action="store",
+        help="A comma-separated list of years and ranges of years, e.g. "
+        "2002-2017. Each needs its flows aggregated with "
+        "aggregate_lodes_tract_level.py -y <year>.",
+        required=True,
+    )
+    parser.add_argument(
+        "-s",
+        "--states",
+        action="store",
+        help="A comma-separated list of two-letter state USPS codes to include "
+        "in the networks. If this argument is absent use all 50 states + DC.",
+        default=None,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        help="The name of a subfolder of data/derived to save to. If this "
+        "argument is absent, save to data/derived directly",
+        default=None,
+    )
+    parser.add_argument(
+        "-m",
+        "--minimum-weight",
+        action="store",
+        help="The minimum number of trips required to keep an edge in a year. "
+        "Edges below it in a year count as absent from it.",
+        default=0,
+    )
+    parser.add_argument(
+        "--weight-segment",
+        action="store",
+        help=f"A job segment ({', '.join(SEGMENTS)}) to use as the weight "
+        "instead of all jobs (S000).",
+        default=None,
+    )
+    parser.add_argument(
+        "-n",
+        "--networks",
+        action="store",
+        help="A comma-separated list of years of the panel to write as "
+        "networks, to <name>_commuter_flows_<year>, or 'all'.",
+        default=None,
+    )
+    parser.add_argument(
+        "-d",
+        "--diffs",
+        action="store",
+        help="A comma-separated list of before:after pairs of years of the "
+        "panel (e.g. 2010:2016) to write as networks of the flows that "
+        "changed between them, to <name>_commuter_flows_<before>_<after>, "
+        "weighted by the change; 'all' stands for each year and the one before.",
+        default=None,
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        action="store",
+        choices=BACKENDS,
+        help="How to hold the networks in memory.",
+        default="networkx",
+    )
+    parser.add_argument(
+        "-f",
+        "--formats",
+        action="store",
+        help=f"A comma-separated list of output formats ({', '.join(FORMATS)}) "
+        "of the networks. If this argument is absent, write GraphML only.",
+        default="graphml",
+    )
+    instrumentation.add_arguments(parser)
+    args = parser.parse_args()
+
+    instrumentation.start(args)
+    years = parse_years(args.years)
+    if args.networks is None:
+        networks = []
+    elif args.networks.strip().lower() == "all":
+        networks = years
+    else:
+        networks = parse_years(args.networks)
+    main(
+        args.level,
+        years,
+        args.states,
+        args.minimum_weight,
+        args.output,
+        parse_segment(args.weight_segment),
+        networks,
+        parse_diffs(args.diffs, years),
+        args.backend,
+        [x.strip() for x in args.formats.split(",")],
+    )
+    instrumentation.report(
+        panel_dir(args.level, args.output).with_suffix(".profile.json")
+    )
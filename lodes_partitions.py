@@ -0,0 +1,148 @@
+import hashlib
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from columnar import read_table, write_table
+from geocodes import format_geocodes, truncate
+from lodes_store import SEGMENTS, YEAR
+from state_fips_mapping import STATE_TO_FIPS
+
+# The rolled-up LODES flows of each level, partitioned by (home state, work
+# state) so that a network over a few states reads only the flows between
+# them. LODES OD files are split by work state, so every flow in a state's
+# file works there, and its home state is the first two digits of the source.
+#
+#   data/derived/lodes_<level>/partitions/<work>/         a columnar table
+#   data/derived/lodes_<level>/partitions/<work>.json     its partitions
+#
+# with <work> and <home> as state FIPS codes. The flows are sorted by source,
+# so each home state's flows are one run of rows of the work state's table,
+# and the manifest lists the [start, stop) rows of each home state. Reading a
+# few partitions only touches their rows of the memory-mapped columns. The
+# manifest also holds a digest of the table, so that it changes whenever the
+# flows do and build.py can rebuild the networks that read them. Next to
+# the weight (all jobs, S000), the tables hold the sum of each job segment
+# (SA01-SI03) as a column of its own. The flows of years other than YEAR live
+# under data/derived/lodes_<level>/<year>/ instead.
+
+
+def level_dir(level, year=YEAR):
+    """The folder of the rolled-up flows of `level` in `year`."""
+    if year == YEAR:
+        return Path(f"data/derived/lodes_{level}")
+    return Path(f"data/derived/lodes_{level}/{year}")
+
+
+def partition_dir(level, year=YEAR):
+    return level_dir(level, year) / "partitions"
+
+
+def write_partitions(df, level, state, year=YEAR):
+    """Write a state's flows (sorted by source) with the rows of each home state."""
+    work = STATE_TO_FIPS[state]
+    homes = truncate(df["source"].to_numpy(), level, "state")
+    starts = np.flatnonzero(np.diff(homes, prepend=-1))
+    stops = np.append(starts[1:], len(homes))
+    partitions = {
+        home: [int(start), int(stop)]
+        for home, start, stop in zip(
+            format_geocodes(homes[starts], "state"), starts, stops
+        )
+    }
+
+    # Segment sums fit in 32 bits, as the block counts do.
+    segments = [column for column in df.columns if column in SEGMENTS]
+    df = df.astype({column: np.int32 for column in segments})
+
+    # The manifest goes last, so readers never see rows it doesn't describe.
+    manifest = partition_dir(level, year) / f"{work}.json"
+    manifest.unlink(missing_ok=True)
+    table = df.loc[:, ["source", "target", "weight"] + segments]
+    write_table(table, partition_dir(level, year) / work)
+    digest = hashlib.sha256()
+    for column, values in table.items():
+        digest.update(column.encode())
+        digest.update(np.ascontiguousarray(values.to_numpy()).tobytes())
+    with open(manifest.with_name(manifest.name + ".tmp"), "w") as f:
+        json.dump(
+            {
+                "state": state,
+                "rows": len(df),
+                "segments": segments,
+                "digest": digest.hexdigest(),
+                "partitions": partitions,
+            },
+            f,
+        )
+    manifest.with_name(manifest.name + ".tmp").replace(manifest)
+
+
+def read_manifest(level, work, year=YEAR):
+    with open(partition_dir(level, year) / f"{work}.json") as f:
+        return json.load(f)
+
+
+def read_flows(level, states=None, segments=(), year=YEAR):
+    """The `year` flows of `level` with both ends in `states` (USPS codes; all if None).
+
+    Only the partitions between the states are read. The rows come state by
+    state (alphabetically if `states` is None), each in flow file order. The
+    job segments in `segments` are read as extra columns next to the weight.
+    """
+    if states is None:
+        states = [
+            state
+            for state in sorted(STATE_TO_FIPS)
+            if (partition_dir(level, year) / f"{STATE_TO_FIPS[state]}.json").is_file()
+        ]
+        homes = set(STATE_TO_FIPS.values())
+    else:
+        homes = {STATE_TO_FIPS[state] for state in states}
+    columns = ["source", "target", "weight"] + list(segments)
+
+    directory = partition_dir(level, year)
+    dfs = []
+    for state in states:
+        work = STATE_TO_FIPS[state]
+        manifest = read_manifest(level, work, year)
+        missing = set(segments) - set(manifest.get("segments", []))
+        if missing:
+            raise ValueError(
+                f"The {level} partitions of {state} have no {sorted(missing)} "
+                "columns; rerun aggregate_lodes_tract_level.py."
+            )
+        ranges = [r for home, r in manifest["partitions"].items() if home in homes]
+        if len(ranges) == len(manifest["partitions"]):
+            dfs.append(read_table(directory / work, columns=columns))
+        elif ranges:
+            rows = np.concatenate([np.arange(start, stop) for start, stop in ranges])
+            dfs.append(read_table(directory / work, columns=columns, rows=rows))
+    counts = {column: "Int64" for column in columns[2:]}
+    if not dfs:
+        return pd.DataFrame(
+            {
+                "source": pd.Series(dtype="int64"),
+                "target": pd.Series(dtype="int64"),
+                **{column: pd.Series(dtype=dtype) for column, dtype in counts.items()},
+            }
+        )
+    df = pd.concat(dfs, axis=0, ignore_index=True)
+    return df.astype(counts)
+
+
+def select_flows(flows, level, states=None):
+    """Select the rows of read_flows(level, states) from all of read_flows(level).
+
+    The rows come in the same order, so one national read can serve networks
+    over many different states.
+    """
+    if states is None:
+        return flows.copy()
+    fips = [int(STATE_TO_FIPS[state]) for state in states]
+    homes = truncate(flows["source"].to_numpy(), level, "state")
+    works = truncate(flows["target"].to_numpy(), level, "state")
+    keep = np.isin(homes, fips)
+    rows = [np.empty(0, dtype=int)]
+    rows += [np.flatnonzero(keep & (works == work)) for work in fips]
+    return flows.take(np.concatenate(rows)).reset_index(drop=True)
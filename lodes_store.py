@@ -0,0 +1,301 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+from columnar import read_arrays, read_table, write_table
+from instrumentation import stage
+from state_fips_mapping import STATE_TO_FIPS
+
+# A binary copy of the LODES OD and crosswalk files of each state, so that
+# repeated builds don't gunzip and parse the same CSVs again. Each file
+# becomes a columnar table under data/derived/lodes_store/<st>/ with the
+# geocodes as int64 and the job counts as int32, which the network and
+# aggregation scripts memory-map and slice without copying. OD rows keep
+# their order in the CSV files, so the outputs don't change.
+#
+# A state is converted the first time it is read, and again whenever one of
+# its CSV files is added, removed or modified.
+#
+# The OD files of YEAR, the year the networks are built from, are stored
+# directly under the state; those of any other year (for lodes_panel.py) go to
+# a <year> subfolder, next to the state's crosswalk, which LODES shares
+# across years.
+#
+#   python lodes_store.py -w 8           # convert every state, 8 at a time
+#   python lodes_store.py -w 8 -y 2010   # the same, for the 2010 OD files
+
+STORE_DIR = "data/derived/lodes_store"
+STORE_VERSION = 2
+CHUNKSIZE = 1000000
+YEAR = 2016
+
+# fmt: off
+SEGMENTS = [
+    "SA01", "SA02", "SA03", "SE01", "SE02", "SE03", "SI01", "SI02", "SI03",
+]
+# fmt: on
+OD_COLUMNS = ["w_geocode", "h_geocode", "S000"] + SEGMENTS
+XWALK_COLUMNS = [
+    "tabblk2010",
+    "st",
+    "cty",
+    "trct",
+    "zcta",
+    "stname",
+    "stusps",
+    "ctyname",
+    "trctname",
+    "blklatdd",
+    "blklondd",
+]
+
+
+def parse_segments(segments):
+    """Segment columns from a comma-separated list, or every one for "all"."""
+    if segments is None:
+        return []
+    if segments.strip().lower() == "all":
+        return list(SEGMENTS)
+    columns = [x.strip().upper() for x in segments.split(",")]
+    unknown = [column for column in columns if column not in SEGMENTS]
+    if unknown:
+        raise ValueError(f"Unknown job segments {unknown}; use {SEGMENTS}.")
+    return columns
+
+
+def parse_segment(segment):
+    """One segment column, or None for all jobs (S000)."""
+    if segment is None or segment.strip().upper() == "S000":
+        return None
+    if segment.strip().upper() not in SEGMENTS:
+        raise ValueError(f"Unknown job segment {segment}; use {SEGMENTS}.")
+    return segment.strip().upper()
+
+
+def segment_columns(segments, weight_segment=None):
+    """The segment columns a network reads: its edge attributes and its weight."""
+    columns = list(segments)
+    if weight_segment is not None and weight_segment not in columns:
+        columns.append(weight_segment)
+    return columns
+
+
+def add_segment_arguments(parser):
+    """Add the --segments and --weight-segment options to a network script."""
+    parser.add_argument(
+        "--segments",
+        action="store",
+        help="A comma-separated list of LODES job segments to add as edge "
+        "attributes next to the weight (SA01-SA03 by age, SE01-SE03 by "
+        "earnings, SI01-SI03 by industry), or all of them with 'all'.",
+        default=None,
+    )
+    parser.add_argument(
+        "--weight-segment",
+        action="store",
+        help="A job segment to use as the weight, and to apply the minimum "
+        "weight to, instead of all jobs (S000).",
+        default=None,
+    )
+
+
+def od_files(state, year=YEAR):
+    return glob.glob(f"data/raw/LODES7/{state}/od/{state}_od_*_JT00_{year}.csv.gz")
+
+
+def xwalk_file(state):
+    return f"data/raw/LODES7/{state}/{state}_xwalk.csv.gz"
+
+
+def state_dir(state, year=YEAR):
+    if year == YEAR:
+        return Path(STORE_DIR) / state
+    return Path(STORE_DIR) / state / str(year)
+
+
+def stamps(state, year=YEAR):
+    # The crosswalk is converted with the OD files of YEAR only.
+    fnames = od_files(state, year) + ([xwalk_file(state)] if year == YEAR else [])
+    stamps = {}
+    for fname in fnames:
+        stat = os.stat(fname)
+        stamps[fname] = [stat.st_size, stat.st_mtime_ns]
+    return {"version": STORE_VERSION, "inputs": stamps}
+
+
+def read_od_file(fname):
+    return pd.read_csv(
+        fname,
+        sep=",",
+        usecols=OD_COLUMNS,
+        compression="gzip",
+        encoding="latin-1",
+        dtype={
+            column: "int64" if column.endswith("geocode") else "int32"
+            for column in OD_COLUMNS
+        },
+    ).loc[:, OD_COLUMNS]
+
+
+def read_xwalk_file(fname):
+    xwalk = pd.read_csv(
+        fname,
+        sep=",",
+        usecols=XWALK_COLUMNS,
+        compression="gzip",
+        encoding="latin-1",
+        dtype={
+            column: "category" if column.endswith("name") else "str"
+            for column in XWALK_COLUMNS
+        },
+    )
+    # Keep the file's column order, which the tract metadata follows.
+    xwalk["tabblk2010"] = xwalk["tabblk2010"].astype(np.int64)
+    return xwalk
+
+
+def convert(state, force=False, year=YEAR):
+    """Convert a state's CSV files if they changed; returns whether it did."""
+    current = stamps(state, year)
+    path = state_dir(state, year) / "inputs.json"
+    if not force and path.is_file():
+        with open(path) as f:
+            saved = json.load(f)
+        saved.pop("parts", None)
+        if saved == current:
+            return False
+
+    parts = []
+    with stage("convert LODES files") as record:
+        record["rows"] = 0
+        for fname in od_files(state, year):
+            part = Path(fname).name.split("_")[2]
+            od = read_od_file(fname)
+            write_table(od, state_dir(state, year) / f"od_{part}")
+            record["rows"] += len(od)
+            parts.append(part)
+        if year == YEAR:
+            xwalk = read_xwalk_file(xwalk_file(state))
+            write_table(xwalk, state_dir(state) / "xwalk")
+
+    # The parts are listed in the order the CSV files were globbed, which is
+    # the order their rows were read in before.
+    current["parts"] = parts
+    # A year without OD files has no tables to create its folder.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(current, f)
+    tmp.replace(path)
+    return True
+
+
+def od_parts(state, year=YEAR):
+    """The names of a state's OD tables, converting the state first if needed.
+
+    A state with neither CSV files nor a store has no tables, nor has a year
+    without OD files.
+    """
+    if os.path.isdir(f"data/raw/LODES7/{state}"):
+        convert(state, year=year)
+    path = state_dir(state, year) / "inputs.json"
+    if not path.is_file():
+        return []
+    with open(path) as f:
+        return json.load(f)["parts"]
+
+
+def od_arrays(state, part, columns=("w_geocode", "h_geocode", "S000"), year=YEAR):
+    """The memory-mapped columns of one of a state's OD tables."""
+    return read_arrays(state_dir(state, year) / f"od_{part}", columns=list(columns))
+
+
+def od_chunks(
+    state,
+    chunksize=CHUNKSIZE,
+    columns=("w_geocode", "h_geocode", "S000"),
+    year=YEAR,
+):
+    """Yield (part, arrays) for slices of up to `chunksize` rows of each OD table.
+
+    The arrays are views of the memory-mapped columns, so only the rows that
+    are used are read from disk. With chunksize=None, each table is a single
+    slice.
+    """
+    for part in od_parts(state, year):
+        arrays = od_arrays(state, part, columns, year)
+        rows = len(arrays[columns[0]])
+        step = max(rows if chunksize is None else chunksize, 1)
+        # An empty table still yields one (empty) slice.
+        for start in range(0, max(rows, 1), step):
+            yield part, {k: v[start : start + step] for k, v in arrays.items()}
+
+
+def read_xwalk(state, columns=None):
+    od_parts(state)
+    return read_table(state_dir(state) / "xwalk", columns=columns)
+
+
+def main(states=None, workers=1, force=False, year=YEAR):
+    if states is None:
+        states = sorted(STATE_TO_FIPS)
+    else:
+        states = [x.strip().lower() for x in states.split(",")]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for state, converted in zip(
+            states,
+            tqdm(
+                executor.map(
+                    convert, states, [force] * len(states), [year] * len(states)
+                ),
+                total=len(states),
+            ),
+        ):
+            if converted:
+                tqdm.write(f"{state}: converted")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert the LODES OD and crosswalk files into the binary "
+        "LODES store."
+    )
+    parser.add_argument(
+        "-s",
+        "--states",
+        action="store",
+        help="A comma-separated list of two-letter state USPS codes to "
+        "convert. If this argument is absent, convert all 50 states + DC.",
+        default=None,
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        action="store",
+        type=int,
+        help="The number of states to convert in parallel.",
+        default=1,
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Convert the states even if their CSV files are unchanged.",
+    )
+    parser.add_argument(
+        "-y",
+        "--year",
+        action="store",
+        type=int,
+        help=f"The year of the OD files to convert. If this argument is absent, "
+        f"convert those of {YEAR}.",
+        default=YEAR,
+    )
+    args = parser.parse_args()
+    main(args.states, args.workers, args.force, args.year)
@@ -0,0 +1,326 @@
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from build import SHARED_MODULES
+from geography_store import GROUPS
+from lodes_partitions import partition_dir
+from lodes_store import od_files, xwalk_file
+from state_fips_mapping import STATE_TO_FIPS
+
+# A cache of built networks, keyed on what determines them: the level, the
+# normalized options of construct_network (states sorted, formats as a set,
+# and so on, but not the output folder) and the content of every file the
+# build reads, including the code. A network asked for again with the same
+# key is copied from the cache into its output folder instead of being built.
+#
+#   data/cache/results/<key>/            the output files of one build
+#   data/cache/results/<key>/entry.json  its key, size and last use
+#   data/cache/results/digests.json      file hashes, by size and mtime
+#
+# Files are hashed once per size and mtime, as build.py does. Once the cache
+# outgrows MAX_SIZE_MB, the least recently used entries are evicted.
+#
+#   python result_cache.py               # list the entries
+#   python result_cache.py -p 2000       # evict down to 2,000 MB
+
+CACHE_DIR = "data/cache/results"
+CACHE_VERSION = 1
+MAX_SIZE_MB = 10240
+ENTRY = "entry.json"
+# How each format names its output.
+SUFFIXES = {"graphml": ".graphml", "bundle": ".bundle"}
+
+
+class Digests:
+    """File hashes, recomputed only when a file's size or mtime changes."""
+
+    def __init__(self, path=Path(CACHE_DIR) / "digests.json"):
+        self.path = Path(path)
+        self.files = {}
+        if self.path.is_file():
+            with open(self.path) as f:
+                self.files = json.load(f)
+
+    def digest(self, fname):
+        stat = os.stat(fname)
+        cached = self.files.get(str(fname))
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(fname, "rb") as f:
+            for block in iter(lambda: f.read(2 ** 20), b""):
+                digest.update(block)
+        self.files[str(fname)] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.files, f)
+        tmp.replace(self.path)
+
+
+def normalize(options):
+    """The options of a construct_network call that decide its output."""
+    thresholds = options.get("thresholds")
+    states = options.get("states")
+    if states is not None:
+        states = sorted({x.strip().lower() for x in states.split(",")})
+    geographies = options.get("geographies")
+    normalized = {
+        "states": states,
+        "backend": options.get("backend"),
+        "formats": sorted(set(options.get("formats"))),
+        "geographies": None if geographies is None else sorted(set(geographies)),
+        "thresholds": None if thresholds is None else sorted(set(thresholds)),
+        "segments": list(options.get("segments") or []),
+        "weight_segment": options.get("weight_segment"),
+    }
+    if thresholds is None:
+        normalized["minimum_weight"] = int(options["minimum_weight"])
+    else:
+        normalized["summary_only"] = bool(options.get("summary_only"))
+    return normalized
+
+
+def tables(directory):
+    """The files of the columnar tables under `directory`."""
+    return sorted(str(p) for p in Path(directory).rglob("*") if p.is_file())
+
+
+def input_files(level, states):
+    """Every data file a build of `level` over `states` (USPS codes) reads."""
+    if level in ["county", "town"]:
+        table = {"county": "table1", "town": "table3"}[level]
+        return [f"data/raw/{table}.xlsx"] + GROUPS[level][0]()
+
+    files = GROUPS["crosswalk"][0]()
+    if level == "block":
+        for state in sorted(STATE_TO_FIPS) if states is None else states:
+            files += sorted(od_files(state))
+            if os.path.exists(xwalk_file(state)):
+                files.append(xwalk_file(state))
+        return files
+
+    flows = level[len("lodes_") :] if level.startswith("lodes_") else level
+    files += GROUPS["tract" if flows == "tract" else "county"][0]()
+    directory = partition_dir(flows)
+    if states is None:
+        works = sorted(STATE_TO_FIPS.values())
+    else:
+        works = sorted(STATE_TO_FIPS[state] for state in states)
+    for work in works:
+        if (directory / f"{work}.json").is_file():
+            files += [str(directory / f"{work}.json")] + tables(directory / work)
+    return files
+
+
+def code_files(construct):
+    """The source of the script of `construct` and of the modules it shares."""
+    root = Path(inspect.getsourcefile(construct)).parent
+    return [inspect.getsourcefile(construct)] + [
+        str(root / fname) for fname in SHARED_MODULES
+    ]
+
+
+def key(level, construct, options, digests):
+    """The cache key of a build and the signature it is the hash of."""
+    normalized = normalize(options)
+    signature = {
+        "version": CACHE_VERSION,
+        "level": level,
+        "options": normalized,
+        "inputs": {
+            fname: digests.digest(fname)
+            for fname in input_files(level, normalized["states"])
+        },
+        "code": {
+            Path(fname).name: digests.digest(fname) for fname in code_files(construct)
+        },
+    }
+    text = json.dumps(signature, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest(), signature
+
+
+def output_dir(options):
+    output = options.get("output")
+    return Path("data/derived") if output is None else Path("data/derived", output)
+
+
+def outputs(level, options):
+    """The names of the files a build writes to its output folder."""
+    name = f"{level}_commuter_flows"
+    thresholds = options.get("thresholds")
+    if thresholds is None:
+        stems = [name]
+    elif options.get("summary_only"):
+        stems = []
+    else:
+        stems = [f"{name}_m{threshold}" for threshold in sorted(set(thresholds))]
+    files = [stem + SUFFIXES[fmt] for stem in stems for fmt in options["formats"]]
+    if level in ["county", "town"]:
+        # Their edge tables, one per threshold in a sweep.
+        files += [f"{stem}.tsv" for stem in stems]
+    if thresholds is not None:
+        files.append(f"{name}.sweep.tsv")
+    return files
+
+
+def copy(source, destination):
+    if Path(destination).is_dir():
+        shutil.rmtree(destination)
+    if Path(source).is_dir():
+        shutil.copytree(source, destination)
+    else:
+        shutil.copy2(source, destination)
+
+
+def size(path):
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def read_entry(path):
+    with open(Path(path) / ENTRY) as f:
+        return json.load(f)
+
+
+def write_entry(path, entry):
+    tmp = Path(path) / (ENTRY + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(entry, f, indent=2)
+    tmp.replace(Path(path) / ENTRY)
+
+
+def restore(level, options, digest):
+    """Copy a cached build's files to its output folder; returns whether it did."""
+    entry_dir = Path(CACHE_DIR) / digest
+    if not (entry_dir / ENTRY).is_file():
+        return False
+    entry = read_entry(entry_dir)
+    destination = output_dir(options)
+    destination.mkdir(parents=True, exist_ok=True)
+    for fname in outputs(level, options):
+        copy(entry_dir / fname, destination / fname)
+    entry["used"] = time.time()
+    write_entry(entry_dir, entry)
+    return True
+
+
+def save(level, options, digest, signature):
+    """Copy a finished build's files into the cache, then evict to the cap."""
+    entry_dir = Path(CACHE_DIR) / digest
+    tmp = entry_dir.with_name(entry_dir.name + ".tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+    for fname in outputs(level, options):
+        copy(output_dir(options) / fname, tmp / fname)
+    now = time.time()
+    write_entry(tmp, {**signature, "size": size(tmp), "created": now, "used": now})
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    tmp.rename(entry_dir)
+    prune(MAX_SIZE_MB)
+
+
+def entries():
+    """Every entry of the cache, least recently used first."""
+    found = []
+    if Path(CACHE_DIR).is_dir():
+        for path in Path(CACHE_DIR).iterdir():
+            if (path / ENTRY).is_file():
+                found.append((path.name, read_entry(path)))
+    return sorted(found, key=lambda item: item[1]["used"])
+
+
+def prune(max_size_mb):
+    """Evict the least recently used entries until the cache fits; returns them."""
+    found = entries()
+    total = sum(entry["size"] for _, entry in found)
+    evicted = []
+    for digest, entry in found:
+        if total <= max_size_mb * 2 ** 20:
+            break
+        shutil.rmtree(Path(CACHE_DIR) / digest)
+        total -= entry["size"]
+        evicted.append(digest)
+    return evicted
+
+
+def lookup(level, construct, *args, **kwargs):
+    """The key of construct(*args, **kwargs), its signature and bound arguments."""
+    bound = inspect.signature(construct).bind(*args, **kwargs)
+    bound.apply_defaults()
+    digests = Digests()
+    digest, signature = key(level, construct, bound.arguments, digests)
+    digests.save()
+    return digest, signature, bound.arguments
+
+
+def cached(level, construct):
+    """Wrap a script's construct_network so it goes through the cache.
+
+    The wrapper takes the same arguments. On a hit it copies the cached files
+    to the output folder and returns None rather than a network.
+    """
+
+    def call(*args, **kwargs):
+        digest, signature, options = lookup(level, construct, *args, **kwargs)
+        if restore(level, options, digest):
+            print(f"{level} network restored from the cache ({digest[:12]})")
+            return None
+        G = construct(*args, **kwargs)
+        save(level, options, digest, signature)
+        return G
+
+    return call
+
+
+def add_arguments(parser):
+    """Add the --cache option to a network script's parser."""
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Copy the network from the result cache ({CACHE_DIR}) if it was "
+        "built before from the same inputs and options, and cache it otherwise.",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List or prune the cache of built networks."
+    )
+    parser.add_argument(
+        "-p",
+        "--prune",
+        action="store",
+        type=float,
+        help="Evict the least recently used entries until the cache is at most "
+        "this many MB.",
+        default=None,
+    )
+    parser.add_argument(
+        "--clear",
+        action="store_true",
+        help="Remove every entry of the cache.",
+    )
+    args = parser.parse_args()
+
+    if args.clear or args.prune is not None:
+        evicted = prune(0 if args.clear else args.prune)
+        print(f"evicted {len(evicted)} entries")
+    total = 0
+    for digest, entry in entries():
+        total += entry["size"]
+        states = entry["options"]["states"]
+        used = time.strftime("%Y-%m-%d %H:%M", time.localtime(entry["used"]))
+        print(
+            f"{digest[:12]}  {entry['level']:<12} "
+            f"{'all' if states is None else ','.join(states):<20} "
+            f"{entry['size'] / 2 ** 20:>10.1f} MB  last used {used}"
+        )
+    print(f"total {total / 2 ** 20:.1f} MB")
@@ -0,0 +1,67 @@
+import filecmp
+import os
+import shutil
+import sys
+from pathlib import Path
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+import aggregate_lodes_tract_level  # noqa: E402
+import geography_store  # noqa: E402
+import lodes_store  # noqa: E402
+from synthetic_data import generate  # noqa: E402
+
+# The tests run the scripts on the synthetic data of benchmarks/synthetic_data.py,
+# from a directory that holds it as the scripts expect to find it in the
+# repository.
+
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory):
+    """Synthetic inputs with the LODES store, partitions and geography built."""
+    root = tmp_path_factory.mktemp("synthetic")
+    generate(root)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        lodes_store.main()
+        aggregate_lodes_tract_level.main(levels=["tract", "county", "state"])
+        for group in geography_store.GROUPS:
+            geography_store.refresh(group)
+    finally:
+        os.chdir(cwd)
+    return root
+
+
+@pytest.fixture
+def workdir(synthetic, monkeypatch):
+    """Run the test in the shared synthetic data, which it mustn't change."""
+    monkeypatch.chdir(synthetic)
+    return synthetic
+
+
+@pytest.fixture
+def copy(synthetic, tmp_path, monkeypatch):
+    """Run the test in a copy of the synthetic data of its own to change."""
+    root = tmp_path / "copy"
+    shutil.copytree(synthetic, root)
+    monkeypatch.chdir(root)
+    return root
+
+
+def same_files(a, b):
+    """Whether the file or directory `a` has the same contents as `b`."""
+    if Path(a).is_dir():
+        compare = filecmp.dircmp(a, b)
+        return (
+            not compare.left_only
+            and not compare.right_only
+            and all(
+                same_files(Path(a, name), Path(b, name))
+                for name in compare.common_files + compare.common_dirs
+            )
+        )
+    return filecmp.cmp(a, b, shallow=False)
@@ -0,0 +1,44 @@
+import json
+from pathlib import Path
+import pytest
+import construct_batch
+from conftest import same_files
+
+# A batch writes each network exactly as its own script run would.
+
+JOBS = [
+    {"level": "county", "output": "batch_county_all"},
+    {"level": "county", "states": ["ct", "ma"], "minimum_weight": 5},
+    {"level": "town", "states": "ri,ct", "formats": ["graphml", "bundle"]},
+    {"level": "tract", "states": ["ma"], "backend": "csr", "segments": "all"},
+    {"level": "tract", "thresholds": [1, 10], "weight_segment": "SE01"},
+    {"level": "block", "states": ["ri", "ct"], "minimum_weight": 2},
+    {"level": "block", "states": ["ri", "ma"], "geographies": ["44001", "ma"]},
+    {"level": "lodes_county", "minimum_weight": 3},
+]
+
+
+def test_batch_matches_separate_builds(copy):
+    spec = [{"output": f"batch_{i}", **job} for i, job in enumerate(JOBS)]
+    Path("spec.json").write_text(json.dumps(spec))
+    construct_batch.main("spec.json")
+
+    for job in construct_batch.read_spec("spec.json"):
+        level = job["level"]
+        args, kwargs = construct_batch.arguments(level, job)
+        args[args.index(job["output"])] = f"separate_{job['output']}"
+        construct_batch.MODULES[level].construct_network(*args, **kwargs)
+        batch = Path("data/derived", job["output"])
+        separate = Path("data/derived", f"separate_{job['output']}")
+        names = sorted(p.name for p in batch.iterdir())
+        assert names == sorted(p.name for p in separate.iterdir())
+        assert names
+        for name in names:
+            assert same_files(batch / name, separate / name), name
+
+
+def test_thresholds_replace_minimum_weight(copy):
+    spec = [{"level": "county", "minimum_weight": 5, "thresholds": [1, 10]}]
+    Path("spec.json").write_text(json.dumps(spec))
+    with pytest.raises(ValueError, match="Thresholds replace"):
+        construct_batch.read_spec("spec.json")
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+import aggregate_lodes_tract_level
+import lodes_panel
+import lodes_store
+
+# Panels over a 2015 made from the synthetic 2016, with some of its flows
+# changed, in a few states.
+
+STATES = "ct,ma,ri"
+
+
+def write_year(state, year, seed):
+    """Write the OD files of a state's 2016 to `year`, changing some weights."""
+    rng = np.random.default_rng(seed)
+    for fname in lodes_store.od_files(state):
+        od = pd.read_csv(fname)
+        changed = rng.random(len(od)) < 0.2
+        od.loc[changed, "S000"] += rng.integers(1, 5, changed.sum())
+        od.to_csv(fname.replace("_2016.", f"_{year}."), index=False)
+
+
+def aggregate(states, year):
+    aggregate_lodes_tract_level.main(states=states, levels=["tract"], year=year)
+
+
+def build(years, output="panel"):
+    return lodes_panel.build_panel("tract", years, STATES, output=output)
+
+
+def flows(year, output="panel"):
+    panel = lodes_panel.Panel(lodes_panel.panel_dir("tract", output))
+    return panel.flows(year).sort_values(["source", "target"], ignore_index=True)
+
+
+@pytest.fixture
+def years(copy):
+    for seed, state in enumerate(STATES.split(",")):
+        write_year(state, 2015, seed)
+    aggregate(STATES, 2015)
+    return copy
+
+
+def test_update_from_changed_year(years, capsys):
+    build([2015, 2016])
+    build([2015, 2016])
+    assert "is up to date" in capsys.readouterr().out
+
+    write_year("ma", 2016, 10)
+    aggregate("ma", 2016)
+    build([2015, 2016])
+    assert "from 2016, as it changed" in capsys.readouterr().out
+
+    build([2015, 2016], "fresh")
+    for year in [2015, 2016]:
+        pd.testing.assert_frame_equal(flows(year), flows(year, "fresh"))
+
+
+def test_extend_then_update(years, capsys):
+    build([2015])
+    build([2015, 2016])
+    assert "Extending the panel in" in capsys.readouterr().out
+    write_year("ri", 2015, 20)
+    aggregate("ri", 2015)
+    build([2015])
+    # Asking for some of the years builds all of them again.
+    assert "as 2015 changed" in capsys.readouterr().out
+    build([2015, 2016], "fresh")
+    for year in [2015, 2016]:
+        pd.testing.assert_frame_equal(flows(year), flows(year, "fresh"))
+
+
+def test_missing_year(years):
+    assert lodes_store.od_parts("ma", 2014) == []
+    assert list(lodes_store.od_chunks("ma", year=2014)) == []
+    build([2015, 2016])
+    with pytest.raises(ValueError, match="2014 has no tract partitions"):
+        build([2014, 2015, 2016])
+    # The panel is kept as it was.
+    assert [entry["year"] for entry in build([2015, 2016])["years"]] == [2015, 2016]
+
+
+def test_no_block_panels(years):
+    with pytest.raises(ValueError, match="no block panels"):
+        lodes_panel.build_panel("block", [2015, 2016], STATES)
@@ -0,0 +1,61 @@
+import filecmp
+import pandas as pd
+import construct_county_network
+import construct_tract_network
+from lodes_partitions import partition_dir
+import result_cache
+
+# A cached build is restored when its options and inputs are the same, and
+# built again when either changes.
+
+
+def county(*args, **kwargs):
+    return result_cache.cached("county", construct_county_network.construct_network)(
+        *args, **kwargs
+    )
+
+
+def test_hit_on_same_options(copy):
+    assert county("ct,ma", 5, "first") is not None
+    assert county(" MA,ct", "5", "second") is None
+    for fname in ["county_commuter_flows.graphml", "county_commuter_flows.tsv"]:
+        assert filecmp.cmp(
+            copy / "data/derived/first" / fname,
+            copy / "data/derived/second" / fname,
+            shallow=False,
+        )
+
+
+def test_miss_on_changed_options(copy):
+    assert county("ct,ma", 5, "first") is not None
+    assert county("ct,ma", 6, "second") is not None
+    assert county("ct,ma,ri", 5, "third") is not None
+    assert county("ct,ma", 5, "fourth", formats=["bundle"]) is not None
+    assert county("ct,ma", 5, "fifth") is None
+
+
+def test_miss_on_changed_input(copy):
+    assert county(None, 0, "first") is not None
+    table = pd.read_excel("data/raw/table1.xlsx", header=None)
+    table.iloc[:-1].to_excel("data/raw/table1.xlsx", header=False, index=False)
+    assert county(None, 0, "second") is not None
+    assert county(None, 0, "third") is None
+
+
+def test_miss_on_changed_partition(copy):
+    tract = result_cache.cached("tract", construct_tract_network.construct_network)
+    assert tract("ri", 0, "first") is not None
+    # Touching a partition without changing it keeps the key.
+    partition = partition_dir("tract") / "44.json"
+    partition.touch()
+    assert tract("ri", 0, "second") is None
+    partition.write_text(partition.read_text() + " ")
+    assert tract("ri", 0, "third") is not None
+
+
+def test_sweep_restores_every_file(copy):
+    assert county(None, 0, "first", thresholds=[1, 20]) is not None
+    assert county(None, 0, "second", thresholds=[20, 1]) is None
+    files = sorted(p.name for p in (copy / "data/derived/first").iterdir())
+    assert "county_commuter_flows_m20.tsv" in files
+    assert files == sorted(p.name for p in (copy / "data/derived/second").iterdir())
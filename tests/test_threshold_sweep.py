@@ -0,0 +1,40 @@
+from pathlib import Path
+import pytest
+import construct_block_network
+import construct_county_network
+import construct_lodes_network
+import construct_town_network
+import construct_tract_network
+from conftest import same_files
+
+# A sweep writes the same files as a separate build at each of its thresholds,
+# with the csr backend it builds with.
+
+NETWORKS = {
+    "county": (construct_county_network.construct_network, []),
+    "town": (construct_town_network.construct_network, []),
+    "tract": (construct_tract_network.construct_network, []),
+    "block": (construct_block_network.construct_network, []),
+    "lodes_county": (construct_lodes_network.construct_network, ["county"]),
+}
+THRESHOLDS = [1, 5, 20, 60]
+
+
+@pytest.mark.parametrize("name", NETWORKS)
+def test_sweep_matches_separate_builds(workdir, name):
+    construct, args = NETWORKS[name]
+    formats = ["graphml", "bundle"]
+    construct(*args, None, 0, f"sweep_{name}", formats=formats, thresholds=THRESHOLDS)
+    stem = f"{name}_commuter_flows"
+    swept = Path("data/derived", f"sweep_{name}")
+    for threshold in THRESHOLDS:
+        output = f"separate_{name}_m{threshold}"
+        construct(*args, None, threshold, output, "csr", formats)
+        separate = Path("data/derived", output)
+        for suffix in [".graphml", ".bundle", ".tsv"]:
+            if not Path(separate, stem + suffix).exists():
+                continue
+            assert same_files(
+                Path(swept, f"{stem}_m{threshold}{suffix}"),
+                Path(separate, stem + suffix),
+            ), f"{stem}_m{threshold}{suffix}"
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+from network_bundle import write_network
+
+# Networks at many minimum weights from one build. The network is built once
+# at the lowest threshold, with the csr backend and its node attributes, and
+# its edges are sorted by weight, heaviest first. The edges of the network at
+# any higher threshold are then a prefix of that order, and
+# CSRNetwork.subnetwork turns them into the network a build at that threshold
+# would make, without reading, joining or looking anything up again. (The one
+# exception is an edge list that repeats an edge, which the Census tables
+# don't: the network keeps the last of the repeats, which decides whether the
+# edge passes a threshold, while a separate build drops the repeats below the
+# threshold first.) The county and town networks take some node attributes
+# from the rows of their flows, such as the population of targets only, so
+# they set those again at each threshold from the rows that pass it, and write
+# those rows as the threshold's edge list.
+#
+#   tract_commuter_flows_m10.graphml    one network per threshold
+#   tract_commuter_flows.sweep.tsv      nodes, edges and weight kept by each
+#
+# The weight share of a threshold is the weight it keeps over that of every
+# flow the script read, before any minimum weight.
+
+
+def parse_thresholds(thresholds):
+    """Sorted distinct minimum weights from a comma-separated list, if given."""
+    if thresholds is None:
+        return None
+    return sorted({int(x) for x in thresholds.split(",")})
+
+
+def sweep(network, thresholds, weight="weight"):
+    """Yield (threshold, network at that minimum weight) for each threshold."""
+    values = np.asarray(network.edge_attrs[weight], dtype=float)
+    by_weight = np.argsort(-values, kind="stable")
+    descending = -values[by_weight]
+    for threshold in thresholds:
+        count = np.searchsorted(descending, -threshold, side="right")
+        yield threshold, network.subnetwork(np.sort(by_weight[:count]))
+
+
+def summarize(network, threshold, total, weight="weight"):
+    kept = pd.Series(network.edge_attrs[weight]).sum()
+    return {
+        "minimum_weight": threshold,
+        "nodes": network.number_of_nodes(),
+        "edges": network.number_of_edges(),
+        "weight": kept,
+        "weight_share": kept / total if total else np.nan,
+    }
+
+
+def write_sweep(
+    G,
+    stem,
+    thresholds,
+    formats=("graphml",),
+    summary_only=False,
+    total=None,
+    prepare=None,
+):
+    """Write the network at each threshold to `stem`_m<threshold>, and a summary.
+
+    `G` is a CSRNetwork built at the lowest threshold, and `total` the weight
+    of all the flows it was built from, before the threshold (that of `G` if
+    None). `prepare`, if given, is called with each threshold's network and
+    the threshold before the network is written. The summary goes to
+    `stem`.sweep.tsv and is returned as a data frame.
+    """
+    if total is None:
+        total = pd.Series(G.edge_attrs["weight"]).sum()
+    summary = []
+    for threshold, network in sweep(G, thresholds):
+        with stage("threshold", rows=network.number_of_edges()):
+            if prepare is not None:
+                prepare(network, threshold)
+            summary.append(summarize(network, threshold, total))
+            if not summary_only:
+                write_network(network, f"{stem}_m{threshold}", formats)
+    summary = pd.DataFrame(summary)
+    summary.to_csv(f"{stem}.sweep.tsv", sep="\t", index=False)
+    print(summary.to_string(index=False))
+    return summary
+
+
+def add_arguments(parser):
+    """Add the --thresholds and --summary-only options to a script's parser."""
+    parser.add_argument(
+        "-t",
+        "--thresholds",
+        action="store",
+        help="A comma-separated list of minimum weights. If present, build "
+        "the network once and write it at each of these thresholds, to "
+        "<name>_m<threshold>, with the nodes, edges and weight kept by each "
+        "in <name>.sweep.tsv. This replaces --minimum-weight, which may not "
+        "be given with it. The networks are built with the csr backend "
+        "whatever --backend says, and written as a csr build at each "
+        "threshold would write them. The county and town edge lists go to "
+        "<name>_m<threshold>.tsv.",
+        default=None,
+    )
+    parser.add_argument(
+        "--summary-only",
+        action="store_true",
+        help="With --thresholds, write only the summary, not the networks.",
+    )
+
+
+
+def check_arguments(parser, args):
+    """Reject a minimum weight next to thresholds, which replace it."""
+    if args.thresholds is not None and float(args.minimum_weight) != 0:
+        parser.error(
+            "--thresholds replaces --minimum-weight; add the minimum weight to "
+            "the thresholds instead."
+        )